@@ -10,9 +10,21 @@ This module contains the Actor class and all its subclasses that represent
 different types of elements in the game.
 """
 
-import pygame
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict
 from settings import *
+import settings
+
+# pygame is only needed to draw the actors: without it, the game can still be
+# played headless
+try:
+    import pygame
+except ImportError:
+    pygame = None
+
+# Sprites already loaded by load_image, shared by all the actors, keyed by
+# (file, width, height, flipped horizontally), the size being in pixels
+_sprites: Dict[Tuple[str, int, int, bool], 'pygame.Surface'] = {}
+_sprite_stats = {"hits": 0, "misses": 0, "bytes": 0}
 
 
 class Actor:
@@ -25,8 +37,9 @@ class Actor:
         x coordinate of this actor's location on the stage
     y:
         y coordinate of this actor's location on the stage
-    image:
-        the image of the actor
+    sprite:
+        the file of the image of the actor, and whether it is mirrored
+        horizontally. The image itself is only loaded when it is drawn.
 
     === Private Attributes ===
     _is_stop:
@@ -40,13 +53,22 @@ class Actor:
     y: int
     _is_stop: bool
     _is_push: bool
-    image: pygame.Surface
+    sprite: Optional[Tuple[str, bool]]
 
     def __init__(self, x: int, y: int) -> None:
         self.x, self.y = x, y
         self._is_stop = False
         self._is_push = False
-        self.image = pygame.Surface((TILESIZE, TILESIZE))
+        self.sprite = None
+
+    @property
+    def image(self) -> 'pygame.Surface':
+        """
+        The image of the actor, loaded from its sprite.
+        """
+        if self.sprite is None:
+            return pygame.Surface((settings.TILESIZE, settings.TILESIZE))
+        return load_image(self.sprite[0], flip=self.sprite[1])
 
     def is_stop(self) -> bool:
         """
@@ -60,6 +82,35 @@ class Actor:
         """
         return self._is_push
 
+    def save_state(self) -> tuple:
+        """
+        Return the flags and image of this actor, in a form that can be given
+        back to restore_state.
+        """
+        return self._is_stop, self._is_push, self.sprite
+
+    def restore_state(self, state: tuple) -> None:
+        """
+        Set the flags and image of this actor back to <state>, as returned by
+        save_state.
+        """
+        self._is_stop, self._is_push, self.sprite = state
+
+    def get_flags(self) -> int:
+        """
+        Return the flags of this actor as a bitmask of ATTRIBUTE_BITS.
+        """
+        return (ATTRIBUTE_BITS["Stop"] if self._is_stop else 0) \
+            | (ATTRIBUTE_BITS["Push"] if self._is_push else 0)
+
+    def set_flags(self, flags: int) -> None:
+        """
+        Set the flags of this actor from a bitmask of ATTRIBUTE_BITS, as
+        returned by get_flags.
+        """
+        self._is_stop = bool(flags & ATTRIBUTE_BITS["Stop"])
+        self._is_push = bool(flags & ATTRIBUTE_BITS["Push"])
+
     def copy(self) -> 'Actor':
         """
         Creates an identical copy of self and returns the new copy
@@ -67,7 +118,8 @@ class Actor:
         """
         raise NotImplementedError
 
-    def move(self, game_: 'Game', dx: int, dy: int) -> bool:
+    def move(self, game_: 'Game', dx: int, dy: int,
+             mover: Optional['Actor'] = None) -> bool:
         """
         Function to move an Actor on the screen, to the direction
         indicated by dx and dy
@@ -75,9 +127,15 @@ class Actor:
         game_: the Game object
         dx: the offset in the x coordinate
         dy: the offset in the y coordinate
+        mover: the actor that moves from the tile of <self>, by default the
+            player of the game
 
         Returns whether <self> actually moves.
 
+        The mover itself moves even when it shares its tile with other
+        actors, which stay behind; the blocks it pushes are the actors that
+        get_actor finds along the move.
+
         Note: this method is different from the "player_move" method in the
         Character class. A "player_move" is trigger by key pressed directly.
         This more general "move" can be a move caused by a push. In fact, this
@@ -92,81 +150,40 @@ class Actor:
           objects as long as the move is not blocked by something.
         """
 
-        current_actor = game_.player
-        next_actor = game_.get_actor(self.x + dx, self.y + dy)
-        if not (0 <= self.x + dx <= game_.width and
-                0 <= self.y + dy <= game_.width):
+        current_actor = game_.player if mover is None else mover
+        get_actor = game_.get_actor
+        x, y = self.x, self.y
+        if not (0 <= x + dx < game_.x_tiles and
+                0 <= y + dy < game_.y_tiles):
             return False
 
-        if not game_.get_actor(self.x + dx, self.y + dy):
-            current_actor.x = self.x + dx
-            current_actor.y = self.y + dy
-            return True
-
-        """
-        Idea:
-        While the next block is pushable, check if the next next 
-        block is pushable
-        1. next block is pushable 
-            - if pushing it by one more is out of bounds -> return False
-            - if the next next block is None -> change both blocks coordinates 
-            - if the next next block is Actor
-                - if next next block is_stop = True -> return False
-                - if next next block is_stop = False -> 
-                    check if next block is pushable 
-        
-        """
+        # Scan ahead once along the move, collecting the line of pushable
+        # blocks in front, until an empty tile ends it or something blocks it
+        chain = []
+        ahead = get_actor(x + dx, y + dy)
         i = 1
-        while game_.get_actor(self.x + dx * i, self.y + dy * i).is_push():
-
+        while ahead is not None and ahead.is_push():
             # Cant move if pushable object will go out of bounds
-            if not (0 <= self.x + dx + dx * (i + 1) <= game_.width):
+            if not (0 <= x + dx * (i + 1) < game_.x_tiles and
+                    0 <= y + dy * (i + 1) < game_.y_tiles):
                 return False
-
-            if not (0 <= self.y + dy + dy * (i + 1) <= game_.height):
-                return False
-
-            # if i = 2, then,
-            #    actor(x, y)           -> actor(x + dx, y + dy)
-            #    actor(x + dx, y + dy) -> actor(x + 2dx, y + 2dy)
-
-            # if i = 3, then,
-            #    actor(x, y)           -> actor(x + dx, y + dy)
-            #    actor(x + dx, y + dy) -> actor(x + 2dx, y + 2dy)
-            #    actor(x + 2dx, y + 2dy) -> actor(x + 3dx, y + 3dy)
-
-            # if i = n, then,
-            #    actor(x, y)           -> actor(x + dx, y + dy)
-            #    ...
-            #    actor(x + (n-1)dx, y + (n-1)dy) -> actor(x + ndx, y + ndy)
-
-            # Checks if the last pushable block in a stack of pushable blocks
-            # can be pushed
-            if not game_.get_actor(self.x + dx * (i + 1),
-                                   self.y + dy * (i + 1)):
-                while i >= 0:
-                    game_.get_actor(self.x + dx * i, self.y).x = self.x + dx * (
-                                i + 1)
-                    game_.get_actor(self.x, self.y + dy * i).y = self.y + dy * (
-                                i + 1)
-                    i -= 1
-
-                return True
-
-            if game_.get_actor(self.x + dx * (i + 1),
-                               self.y + dy * (i + 1)).is_stop() and \
-                    not game_.get_actor(self.x + dx * (i + 1),
-                                        self.y + dy * (i + 1)).is_push():
+            chain.append(ahead)
+            ahead = get_actor(x + dx * (i + 1), y + dy * (i + 1))
+            if ahead is not None and ahead.is_stop() and not ahead.is_push():
                 return False
             i += 1
 
-        # Cant move if the next block, in x/y direction, cannot be moved through
-        if next_actor.is_stop() and not next_actor.is_push():
+        if ahead is None:
+            # Push the whole line, starting with the block furthest away
+            for block in reversed(chain):
+                game_.move_actor(block, block.x + dx, block.y + dy)
+        elif not chain and ahead.is_stop():
+            # Cant move if the next block cannot be moved through
             return False
 
-        current_actor.x = self.x + dx
-        current_actor.y = self.y + dy
-
+        # A line ending on something that neither stops nor is pushed does
+        # not move: the player steps onto the first block of it
+        game_.move_actor(current_actor, x + dx, y + dy)
         return True
 
 
@@ -297,6 +314,41 @@ class Character(Actor):
         other._is_lose = self._is_lose
         other._is_win = self._is_win
 
+    def save_state(self) -> tuple:
+        """
+        Return the flags and image of this character, in a form that can be
+        given back to restore_state.
+        """
+        return super().save_state() + (self._is_player, self._is_lose,
+                                       self._is_win)
+
+    def restore_state(self, state: tuple) -> None:
+        """
+        Set the flags and image of this character back to <state>, as returned
+        by save_state.
+        """
+        super().restore_state(state[:3])
+        self._is_player, self._is_lose, self._is_win = state[3:]
+
+    def get_flags(self) -> int:
+        """
+        Return the flags of this character as a bitmask of ATTRIBUTE_BITS.
+        """
+        return super().get_flags() \
+            | (ATTRIBUTE_BITS["You"] if self._is_player else 0) \
+            | (ATTRIBUTE_BITS["Lose"] if self._is_lose else 0) \
+            | (ATTRIBUTE_BITS["Victory"] if self._is_win else 0)
+
+    def set_flags(self, flags: int) -> None:
+        """
+        Set the flags of this character from a bitmask of ATTRIBUTE_BITS, as
+        returned by get_flags.
+        """
+        super().set_flags(flags)
+        self._is_player = bool(flags & ATTRIBUTE_BITS["You"])
+        self._is_lose = bool(flags & ATTRIBUTE_BITS["Lose"])
+        self._is_win = bool(flags & ATTRIBUTE_BITS["Victory"])
+
     def copy(self) -> 'Character':
         """
         Returns a copy of this object itself.
@@ -321,6 +373,13 @@ class Character(Actor):
             dy += 1
         return dx, dy
 
+    def face(self, dx: int, dy: int) -> None:
+        """
+        Turn the character towards the direction of a move by dx and dy.
+        Characters look the same in every direction unless overridden.
+        """
+        pass
+
     def player_move(self, game_: 'Game') -> bool:
         """
         Detects input from the keyboard and moves the Player on the game stage
@@ -353,30 +412,57 @@ class Meepo(Character):
     walk_down:
         Image for walking down
     """
-    walk_left: list
-    walk_right: list
-    walk_down: list
-    walk_up: list
+    # Sprites of the motion images
+    _walk_right = [(PLAYER_SPRITE_R1, False), (PLAYER_SPRITE_R2, False)]
+    _walk_left = [(PLAYER_SPRITE_R1, True), (PLAYER_SPRITE_R2, True)]
+    _walk_up = [(PLAYER_SPRITE_U1, False), (PLAYER_SPRITE_U2, False)]
+    _walk_down = [(PLAYER_SPRITE_B1, False), (PLAYER_SPRITE_B2, False)]
 
     def __init__(self, x: int, y: int) -> None:
         """
         Initializes the Meepo Class
-        Load the images for displaying Ms. Meepo's movement.
         """
         super().__init__(x, y)
+        self.sprite = Meepo._walk_down[1]
+
+    @staticmethod
+    def load_sprites() -> None:
+        """
+        Load every motion image of Meepo into the sprite cache, so that the
+        mirrored images of walking left are built up front rather than on
+        the first move left.
+        """
+        for f, flip in (Meepo._walk_right + Meepo._walk_left
+                        + Meepo._walk_up + Meepo._walk_down):
+            load_image(f, flip=flip)
 
-        # Add motion images
-        self.walk_right = [load_image(PLAYER_SPRITE_R1),
-                           load_image(PLAYER_SPRITE_R2)]
-        self.walk_left = [
-            pygame.transform.flip(load_image(PLAYER_SPRITE_R1), True, False),
-            pygame.transform.flip(load_image(PLAYER_SPRITE_R2), True, False)
-        ]
-        self.walk_up = [load_image(PLAYER_SPRITE_U1),
-                        load_image(PLAYER_SPRITE_U2)]
-        self.walk_down = [load_image(PLAYER_SPRITE_B1),
-                          load_image(PLAYER_SPRITE_B2)]
-        self.image = self.walk_down[1]
+    @property
+    def walk_right(self) -> list:
+        """
+        Images for walking right
+        """
+        return [load_image(f, flip=flip) for f, flip in Meepo._walk_right]
+
+    @property
+    def walk_left(self) -> list:
+        """
+        Images for walking left
+        """
+        return [load_image(f, flip=flip) for f, flip in Meepo._walk_left]
+
+    @property
+    def walk_up(self) -> list:
+        """
+        Images for walking up
+        """
+        return [load_image(f, flip=flip) for f, flip in Meepo._walk_up]
+
+    @property
+    def walk_down(self) -> list:
+        """
+        Images for walking down
+        """
+        return [load_image(f, flip=flip) for f, flip in Meepo._walk_down]
 
     def handle_key_press(self, game_: 'Game') -> Tuple[int, int]:
         """
@@ -385,34 +471,41 @@ class Meepo(Character):
         """
 
         dx, dy = super().handle_key_press(game_)
+        self.face(dx, dy)
+        return dx, dy
+
+    def face(self, dx: int, dy: int) -> None:
+        """
+        Change the image of Meepo to the next motion image in the direction
+        of the move.
+        """
         if dx == -1:
-            if self.image == self.walk_left[0]:
-                self.image = self.walk_left[1]
+            if self.sprite == Meepo._walk_left[0]:
+                self.sprite = Meepo._walk_left[1]
             else:
-                self.image = self.walk_left[0]
+                self.sprite = Meepo._walk_left[0]
         elif dx == 1:
-            if self.image == self.walk_right[1]:
-                self.image = self.walk_right[0]
+            if self.sprite == Meepo._walk_right[1]:
+                self.sprite = Meepo._walk_right[0]
             else:
-                self.image = self.walk_right[1]
+                self.sprite = Meepo._walk_right[1]
         elif dy == -1:
-            if self.image == self.walk_up[0]:
-                self.image = self.walk_up[1]
+            if self.sprite == Meepo._walk_up[0]:
+                self.sprite = Meepo._walk_up[1]
             else:
-                self.image = self.walk_up[0]
+                self.sprite = Meepo._walk_up[0]
         elif dy == 1:
-            if self.image == self.walk_down[1]:
-                self.image = self.walk_down[0]
+            if self.sprite == Meepo._walk_down[1]:
+                self.sprite = Meepo._walk_down[0]
             else:
-                self.image = self.walk_down[1]
-        return dx, dy
+                self.sprite = Meepo._walk_down[1]
 
     def copy(self) -> 'Meepo':
         """
         Returns a copy of Meepo with all of its currently set properties
         """
         meepo_copy = Meepo(self.x, self.y)
-        meepo_copy.image = self.image
+        meepo_copy.sprite = self.sprite
         self.copy_flags(meepo_copy)
         return meepo_copy
 
@@ -427,7 +520,7 @@ class Wall(Character):
         Initializes a Wall object
         """
         super().__init__(x, y)
-        self.image = load_image(WALL_SPRITE)
+        self.sprite = (WALL_SPRITE, False)
 
     def copy(self) -> 'Wall':
         """
@@ -448,7 +541,7 @@ class Rock(Character):
         Initializes a Rock object
         """
         super().__init__(x, y)
-        self.image = load_image(ROCK_SPRITE)
+        self.sprite = (ROCK_SPRITE, False)
 
     def copy(self) -> 'Rock':
         """
@@ -469,7 +562,7 @@ class Flag(Character):
         Initializes a Flag object
         """
         super().__init__(x, y)
-        self.image = load_image(FLAG_SPRITE)
+        self.sprite = (FLAG_SPRITE, False)
 
     def copy(self) -> 'Flag':
         """
@@ -487,7 +580,7 @@ class Bush(Actor):
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y)
-        self.image = load_image(BUSH_SPRITE)
+        self.sprite = (BUSH_SPRITE, False)
 
         # Bush is always unmovable and cannot be moved through
         self._is_stop = True
@@ -538,13 +631,13 @@ class Subject(Block):
         super().__init__(x, y, word_)
 
         if word_ == "Meepo":
-            self.image = load_image("./sprites/meepo.png")
+            self.sprite = ("./sprites/meepo.png", False)
         if word_ == "Wall":
-            self.image = load_image("./sprites/wall.png")
+            self.sprite = ("./sprites/wall.png", False)
         if word_ == "Flag":
-            self.image = load_image("./sprites/flag.png")
+            self.sprite = ("./sprites/flag.png", False)
         if word_ == "Rock":
-            self.image = load_image("./sprites/rock.png")
+            self.sprite = ("./sprites/rock.png", False)
 
     def copy(self):
         """
@@ -565,15 +658,15 @@ class Attribute(Block):
         """
         super().__init__(x, y, word_)
         if word_ == "Push":
-            self.image = load_image("./sprites/push.png")
+            self.sprite = ("./sprites/push.png", False)
         if word_ == "Stop":
-            self.image = load_image("./sprites/stop.png")
+            self.sprite = ("./sprites/stop.png", False)
         if word_ == "Victory":
-            self.image = load_image("./sprites/victory.png")
+            self.sprite = ("./sprites/victory.png", False)
         if word_ == "Lose":
-            self.image = load_image("./sprites/lose.png")
+            self.sprite = ("./sprites/lose.png", False)
         if word_ == "You":
-            self.image = load_image("./sprites/you.png")
+            self.sprite = ("./sprites/you.png", False)
 
     def copy(self):
         """
@@ -589,7 +682,7 @@ class Is(Block):
 
     def __init__(self, x: int, y: int) -> None:
         super().__init__(x, y, " is")  # Note the space in " is"
-        self.image = load_image(IS_PURPLE)
+        self.sprite = (IS_PURPLE, False)
 
     def update(self, up: Optional[Actor],
                down: Optional[Actor],
@@ -633,11 +726,11 @@ class Is(Block):
             is_left_right = left.word + self.word + right.word
 
         if is_up_down == "" or is_left_right == "":
-            self.image = load_image(IS_LIGHT_BLUE)
+            self.sprite = (IS_LIGHT_BLUE, False)
         if is_up_down != "" and is_left_right != "":
-            self.image = load_image(IS_DARK_BLUE)
+            self.sprite = (IS_DARK_BLUE, False)
         if is_up_down == "" and is_left_right == "":
-            self.image = load_image(IS_PURPLE)
+            self.sprite = (IS_PURPLE, False)
 
         return is_up_down, is_left_right
 
@@ -646,18 +739,112 @@ class Is(Block):
         Returns a copy of the Is block with all of its currently set properties
         """
         is_copy = Is(self.x, self.y)
-        is_copy.image = self.image
+        is_copy.sprite = self.sprite
         return is_copy
 
 
-def load_image(img_name: str, width: int = TILESIZE,
-               height: int = TILESIZE) -> pygame.image:
+def load_image(img_name: str, width: Optional[int] = None,
+               height: Optional[int] = None,
+               flip: bool = False) -> 'pygame.Surface':
     """
     Return a pygame img of the PNG img_name that has been scaled according
-    to the given width and size
+    to the given width and size, by default settings.TILESIZE as it is when
+    called, and mirrored horizontally if <flip> is True.
+
+    Each sprite is only read from disk once: the same Surface is returned to
+    every caller asking for it afterwards, so it must not be drawn on.
+    """
+    width = settings.TILESIZE if width is None else width
+    height = settings.TILESIZE if height is None else height
+    key = (img_name, width, height, flip)
+    img = _sprites.get(key)
+    if img is not None:
+        _sprite_stats["hits"] += 1
+        return img
+
+    _sprite_stats["misses"] += 1
+    if flip:
+        img = pygame.transform.flip(load_image(img_name, width, height),
+                                    True, False)
+    else:
+        img = pygame.image.load(img_name).convert_alpha()
+        img = pygame.transform.scale(img, (width, height))
+    _sprites[key] = img
+    _sprite_stats["bytes"] += img.get_pitch() * img.get_height()
+    return img
+
+
+class SpriteAtlas:
+    """
+    The sprites drawn by a game packed side by side into one surface, so that
+    many actors can be drawn by a single Surface.blits call.
+
+    The colours of the atlas are premultiplied by their alpha: its sprites
+    must be drawn with the flag pygame.BLEND_PREMULTIPLIED.
+
+    === Public Attributes ===
+    surface:
+        the surface holding the sprites
+
+    === Private Attributes ===
+    _areas:
+        the area of surface holding each sprite, by sprite key
+    """
+    surface: 'pygame.Surface'
+    _areas: Dict[Optional[Tuple[str, bool]], 'pygame.Rect']
+
+    def __init__(self, capacity: int = 32) -> None:
+        """
+        Initialize an empty atlas with room for <capacity> sprites, which
+        grows when needed.
+        """
+        self.surface = pygame.Surface((capacity * TILESIZE, TILESIZE),
+                                      pygame.SRCALPHA)
+        self._areas = {}
+
+    def area(self, sprite: Optional[Tuple[str, bool]]) -> 'pygame.Rect':
+        """
+        Return the area of the atlas holding <sprite>, a sprite key of an
+        Actor, adding the sprite to the atlas the first time.
+        """
+        area = self._areas.get(sprite)
+        if area is not None:
+            return area
+
+        if (len(self._areas) + 1) * TILESIZE > self.surface.get_width():
+            surface = pygame.Surface((2 * self.surface.get_width(), TILESIZE),
+                                     pygame.SRCALPHA)
+            # adding to a transparent surface copies the pixels as they are
+            surface.blit(self.surface, (0, 0),
+                         special_flags=pygame.BLEND_RGBA_ADD)
+            self.surface = surface
+        area = pygame.Rect(len(self._areas) * TILESIZE, 0, TILESIZE, TILESIZE)
+        if sprite is None:
+            image = pygame.Surface((TILESIZE, TILESIZE))
+        else:
+            image = load_image(sprite[0], flip=sprite[1])
+        self.surface.blit(image.convert_alpha().premul_alpha(), area,
+                          special_flags=pygame.BLEND_RGBA_ADD)
+        self._areas[sprite] = area
+        return area
+
+
+def sprite_cache_stats() -> Dict[str, int]:
+    """
+    Return the number of hits and misses of the sprite cache, the number of
+    sprites in it and the number of bytes of pixels they hold.
+    """
+    return dict(_sprite_stats, sprites=len(_sprites))
+
+
+def clear_sprite_cache() -> None:
+    """
+    Forget every loaded sprite, e.g. after TILESIZE or the display changed.
+    Actors load their images again, at the new size, the next time they are
+    drawn.
     """
-    img = pygame.image.load(img_name).convert_alpha()
-    return pygame.transform.scale(img, (width, height))
+    _sprites.clear()
+    _sprite_stats.update(hits=0, misses=0, bytes=0)
 
 
 if __name__ == "__main__":
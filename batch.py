@@ -0,0 +1,441 @@
+"""
+A simulator playing many games of the same map at once, e.g. thousands of
+random playouts to tune a level.
+
+The state of every game is held in NumPy arrays with one row per game, and a
+step moves the players of every game with array operations over the whole
+batch. Moves follow Actor.move, quirks included, rules are formed as in
+Is.update and applied as in Game._update, so each game of a batch goes
+through the same states as a Game played with the same moves.
+
+numpy is only needed by this module, not by the game itself.
+"""
+
+from typing import List, Optional, Sequence, Tuple, Union
+from settings import *
+from board import Board, RULES
+from game import Game
+import actor
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_SUBJECTS = list(SUBJECTS.values())
+_ATTRIBUTES = list(ATTRIBUTES.values())
+_PUSH, _STOP = ATTRIBUTE_BITS["Push"], ATTRIBUTE_BITS["Stop"]
+_WIN, _LOSE = ATTRIBUTE_BITS["Victory"], ATTRIBUTE_BITS["Lose"]
+_YOU = ATTRIBUTE_BITS["You"]
+
+# The flags set and cleared on the actors of a subject by each rule
+_SETTERS = {"Push": (_PUSH, _YOU), "Stop": (_STOP, _YOU),
+            "Victory": (_WIN, _LOSE), "Lose": (_LOSE, _WIN),
+            "You": (_YOU, _STOP | _PUSH)}
+
+# Larger than any position along a move
+_NONE = 2 ** 62
+
+
+class BatchGame:
+    """
+    A batch of games of the same map, all played at once.
+
+    Actors are numbered by their slot in the Board of the game the batch
+    started from, in the order of the game's list of actors. Within a cell,
+    the actor of the lowest slot is the one found by Game.get_actor.
+
+    === Public Attributes ===
+    size:
+        the number of games
+    board:
+        the board of the game the batch started from
+    x, y:
+        the position of each actor of each game, as (size, actors) arrays
+    flags:
+        the flags of each actor of each game, as bitmasks of ATTRIBUTE_BITS
+    alive:
+        whether each actor of each game is still in the game
+    player:
+        the slot of the player each game follows, or -1 if there is none
+    running:
+        whether each game is still running, i.e. has not been won
+    rule_order:
+        for each game and each rule of RULES, its position in the list of
+        rules of the game, starting at 1, or 0 if it is not a rule
+
+    === Private Attributes ===
+    _x_tiles, _y_tiles:
+        the size of the map in tiles, which no actor moves out of
+    _subject, _attribute:
+        the word of each actor if it is a Subject or an Attribute block, as
+        an index of SUBJECTS or ATTRIBUTES, or -1
+    _type:
+        the subject naming the type of each actor, as an index of SUBJECTS,
+        or -1 if no rule can apply to it
+    _rank:
+        the position of each actor among the actors of its type
+    _is_slots:
+        the slots of the Is blocks, in the order they are read
+    """
+    size: int
+    board: Board
+    x: 'np.ndarray'
+    y: 'np.ndarray'
+    flags: 'np.ndarray'
+    alive: 'np.ndarray'
+    player: 'np.ndarray'
+    running: 'np.ndarray'
+    rule_order: 'np.ndarray'
+    _x_tiles: int
+    _y_tiles: int
+    _subject: 'np.ndarray'
+    _attribute: 'np.ndarray'
+    _type: 'np.ndarray'
+    _rank: 'np.ndarray'
+    _is_slots: 'np.ndarray'
+
+    def __init__(self, game: Game, size: int) -> None:
+        """
+        Initialize a batch of <size> games all in the current state of
+        <game>, whose rules must be up to date, e.g. from solver.load_game.
+        """
+        if np is None:
+            raise ImportError("the batch simulator needs numpy")
+        self.size = size
+        self.board = game.get_board()
+        actors = self.board.actors
+        self._x_tiles, self._y_tiles = game.x_tiles, game.y_tiles
+
+        def word_index(words: List[str], cls: type, actor_: actor.Actor) \
+                -> int:
+            if isinstance(actor_, cls) and actor_.word in words:
+                return words.index(actor_.word)
+            return -1
+
+        self._subject = np.array(
+            [word_index(_SUBJECTS, actor.Subject, i) for i in actors], int)
+        self._attribute = np.array(
+            [word_index(_ATTRIBUTES, actor.Attribute, i) for i in actors], int)
+        self._type = np.array(
+            [_SUBJECTS.index(type(i).__name__)
+             if isinstance(i, actor.Character)
+             and type(i).__name__ in _SUBJECTS else -1 for i in actors], int)
+        self._rank = np.array(
+            [game.get_instances(type(i)).index(i) for i in actors], int)
+        self._is_slots = np.array(
+            [actors.index(i) for i in game.get_is_blocks()], int)
+
+        def rows(values: List[int], dtype: type) -> 'np.ndarray':
+            return np.tile(np.array(values, dtype), (size, 1))
+
+        self.x = rows([i.x for i in actors], np.int64)
+        self.y = rows([i.y for i in actors], np.int64)
+        self.flags = rows([i.get_flags() for i in actors], np.uint8)
+        self.alive = np.ones((size, len(actors)), bool)
+
+        player = -1 if game.player is None else actors.index(game.player)
+        self.player = np.full(size, player, np.int64)
+        self.running = np.full(size, game.get_running(), bool)
+        order = [0] * len(RULES)
+        for position, rule in enumerate(game.get_rules()):
+            order[RULES.index(rule)] = position + 1
+        self.rule_order = rows(order, np.int64)
+
+    def active(self) -> 'np.ndarray':
+        """
+        Return which games can still be played: they are running and have a
+        player.
+        """
+        return self.running & (self.player >= 0)
+
+    def step(self, moves: Union[str, Sequence[int], 'np.ndarray']) \
+            -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Move the players of each game once, like Game.step. <moves> gives the
+        move of each game, either as a letter of DIRECTIONS, so a string of
+        <size> letters works, or as an index in DIRECTIONS. Games that cannot
+        be played any more are left as they are.
+
+        Return the masks of the games won and of the games lost by this step.
+        """
+        if isinstance(moves, str):
+            moves = [list(DIRECTIONS).index(i) for i in moves]
+        moves = np.asarray(moves)
+        if moves.dtype.kind == 'U':
+            moves = np.array([list(DIRECTIONS).index(i) for i in moves])
+        offsets = np.array(list(DIRECTIONS.values()), np.int64)[moves]
+        dx, dy = offsets[:, 0], offsets[:, 1]
+
+        moved = self._move(dx, dy)
+        won, lost = self._win_or_lose(moved)
+        self._update(moved)
+        return won, lost
+
+    def random_playouts(self, steps: int, seed: Optional[int] = None) \
+            -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Play random moves in every game for up to <steps> steps, or until no
+        game can be played.
+
+        Return, for each game, the step at which it was won and the step at
+        which it was last lost, starting at 1, or 0 if it never was.
+        """
+        rng = np.random.default_rng(seed)
+        won_at = np.zeros(self.size, np.int64)
+        lost_at = np.zeros(self.size, np.int64)
+        for i in range(1, steps + 1):
+            if not self.active().any():
+                break
+            won, lost = self.step(rng.integers(len(DIRECTIONS),
+                                               size=self.size))
+            won_at[won] = i
+            lost_at[lost] = i
+        return won_at, lost_at
+
+    def get_board(self, game: int) -> Board:
+        """
+        Return the state of the game numbered <game> in this batch, as a
+        board using the same slots as self.board.
+        """
+        board = self.board.copy()
+        for slot in range(len(board.actors)):
+            if self.alive[game, slot]:
+                board.set_position(slot, (int(self.x[game, slot]),
+                                          int(self.y[game, slot])))
+                board.set_flags(slot, int(self.flags[game, slot]))
+            else:
+                board.set_position(slot, None)
+                board.set_flags(slot, 0)
+        order = self.rule_order[game]
+        board.set_rules([RULES[i] for i in sorted(np.nonzero(order)[0],
+                                                  key=order.__getitem__)])
+        player = int(self.player[game])
+        board.set_player(None if player < 0 else player)
+        board.set_running(bool(self.running[game]))
+        return board
+
+    def _top(self, x: 'np.ndarray', y: 'np.ndarray') -> 'np.ndarray':
+        """
+        Return, for each game, the slot of the actor that Game.get_actor finds
+        at its position in x and y, or -1 if there is none.
+        """
+        here = self.alive & (self.x == x[:, None]) & (self.y == y[:, None])
+        first = here.argmax(axis=1)
+        return np.where(here.any(axis=1), first, -1)
+
+    def _has(self, slots: 'np.ndarray', bit: int) -> 'np.ndarray':
+        """
+        Return, for each game, whether the actor at its slot in <slots> has
+        the flag <bit>. Slots of -1 have no flags.
+        """
+        flags = self.flags[np.arange(self.size), slots]
+        return (slots >= 0) & (flags & bit != 0)
+
+    def _move_actors(self, mask: 'np.ndarray', slots: 'np.ndarray',
+                     x: 'np.ndarray', y: 'np.ndarray') -> None:
+        """
+        Move the actor at its slot in <slots> to its position in x and y, in
+        each game of <mask>.
+        """
+        games = np.nonzero(mask)[0]
+        self.x[games, slots[games]] = x[games]
+        self.y[games, slots[games]] = y[games]
+
+    def _players(self) -> 'np.ndarray':
+        """
+        Return which actors of each game are moved by its moves, as
+        Game.get_players.
+        """
+        games = np.nonzero(self.player >= 0)[0]
+        players = self.alive & (self.flags & _YOU != 0)
+        players[games, self.player[games]] = True
+        return players
+
+    def _move(self, dx: 'np.ndarray', dy: 'np.ndarray') -> 'np.ndarray':
+        """
+        Move the players of each game by its dx and dy the way
+        Game._move_players does: the player furthest along the move first,
+        and players sharing a tile in the order of their slots.
+
+        Return the mask of the games where a player moved.
+        """
+        players = self._players()
+        along = self.x * dx[:, None] + self.y * dy[:, None]
+        order = np.argsort(np.where(players, -along, _NONE), axis=1,
+                           kind='stable')
+        counts = players.sum(axis=1)
+        moved = np.zeros(self.size, bool)
+        for i in range(int(counts.max(initial=0))):
+            moved |= self._push(order[:, i], self.active() & (counts > i),
+                                dx, dy)
+        return moved
+
+    def _push(self, mover: 'np.ndarray', mask: 'np.ndarray',
+              dx: 'np.ndarray', dy: 'np.ndarray') -> 'np.ndarray':
+        """
+        Move the actor at its slot in <mover> by dx and dy in each game of
+        <mask>, the way Actor.move does, pushing the blocks in the way.
+
+        Return the mask of the games where it moved.
+        """
+        games = np.arange(self.size)
+        px, py = self.x[games, mover], self.y[games, mover]
+        x_tiles, y_tiles = self._x_tiles, self._y_tiles
+
+        # the player walks onto an empty cell or onto an actor it does not
+        # push, and it pushes a line of blocks into an empty cell
+        first = self._top(px + dx, py + dy)
+        in_bounds = mask & (0 <= px + dx) & (px + dx < x_tiles) \
+            & (0 <= py + dy) & (py + dy < y_tiles)
+        walk = in_bounds & ((first < 0) | ~self._has(first, _PUSH)
+                            & ~self._has(first, _STOP))
+        scan = in_bounds & self._has(first, _PUSH)
+        pushed = np.zeros(self.size, np.int64)
+        line = [first]
+        i = 1
+        while scan.any():
+            scan &= (0 <= px + dx * (i + 1)) \
+                & (px + dx * (i + 1) < x_tiles) \
+                & (0 <= py + dy * (i + 1)) & (py + dy * (i + 1) < y_tiles)
+            following = self._top(px + dx * (i + 1), py + dy * (i + 1))
+            pushed[scan & (following < 0)] = i
+            scan &= (following >= 0) & ~(self._has(following, _STOP)
+                                         & ~self._has(following, _PUSH))
+            # the line ends on an actor that neither stops nor is pushed:
+            # the player moves onto the first block, which stays
+            walk |= scan & ~self._has(following, _PUSH)
+            scan &= self._has(following, _PUSH)
+            line.append(following)
+            i += 1
+
+        moved = walk | (pushed > 0)
+        longest = int(pushed.max(initial=0))
+        for i in range(longest, 0, -1):
+            self._move_actors(pushed >= i, line[i - 1], px + dx * (i + 1),
+                              py + dy * (i + 1))
+        self._move_actors(moved, mover, px + dx, py + dy)
+        return moved
+
+    def _win_or_lose(self, moved: 'np.ndarray') \
+            -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        In each game of <moved>, decide each player by the first actor of its
+        tile that wins or loses, as Game.win_or_lose does: the game is won if
+        any player wins, otherwise the players that lose are removed.
+
+        Return the masks of the games won and lost.
+        """
+        games = np.arange(self.size)
+        players = self._players() & moved[:, None]
+        order = np.argsort(~players, axis=1, kind='stable')
+        won = np.zeros(self.size, bool)
+        losing = np.zeros_like(players)
+        for i in range(int(players.sum(axis=1).max(initial=0))):
+            player = order[:, i]
+            here = self.alive & (self.x == self.x[games, player][:, None]) \
+                & (self.y == self.y[games, player][:, None]) \
+                & (self.flags & (_WIN | _LOSE) != 0)
+            first = here.argmax(axis=1)
+            ends = players[games, player] & here.any(axis=1)
+            won |= ends & self._has(first, _WIN)
+            losing[games, player] |= ends & ~self._has(first, _WIN)
+
+        losing &= ~won[:, None]
+        lost = losing.any(axis=1)
+        self.running[won] = False
+        self.alive &= ~losing
+        followed = np.maximum(self.player, 0)
+        self.player[(self.player >= 0) & losing[games, followed]] = -1
+        return won, lost
+
+    def _update(self, changed: 'np.ndarray') -> None:
+        """
+        Form the rules of each game of <changed> from its Is blocks, and
+        apply the rules added and removed as Game._update does.
+        """
+        games = np.arange(self.size)
+        n_attributes = len(_ATTRIBUTES)
+        rule_subject = np.arange(len(RULES)) // n_attributes
+        rule_attribute = np.arange(len(RULES)) % n_attributes
+
+        # the rules formed, with where each one is first read
+        present = np.zeros((self.size, len(RULES)), bool)
+        first_read = np.full((self.size, len(RULES)), _NONE, np.int64)
+        read = 0
+        for slot in self._is_slots:
+            x, y = self.x[:, slot], self.y[:, slot]
+            for before, after in (((x, y - 1), (x, y + 1)),
+                                  ((x - 1, y), (x + 1, y))):
+                above, below = self._top(*before), self._top(*after)
+                subject = np.where(above >= 0, self._subject[above], -1)
+                attribute = np.where(below >= 0, self._attribute[below], -1)
+                formed = changed & (subject >= 0) & (attribute >= 0)
+                rule = subject[formed] * n_attributes + attribute[formed]
+                present[games[formed], rule] = True
+                first_read[games[formed], rule] = np.minimum(
+                    first_read[games[formed], rule], read)
+                read += 1
+        old = self.rule_order > 0
+        removed = old & ~present & changed[:, None]
+        added = present & ~old
+
+        # remove the effects of the rules removed
+        subjects = np.arange(len(_SUBJECTS))
+        instances = self.alive[:, None, :] \
+            & (self._type[None, None, :] == subjects[None, :, None])
+        cleared = np.zeros((self.size, len(_SUBJECTS)), np.uint8)
+        for rule in np.nonzero(removed.any(axis=0))[0]:
+            attribute = _ATTRIBUTES[rule_attribute[rule]]
+            cleared[removed[:, rule], rule_subject[rule]] |= \
+                ATTRIBUTE_BITS[attribute]
+            if attribute == "You":
+                self.player[removed[:, rule]
+                            & instances[:, rule_subject[rule]].any(axis=1)] = -1
+        typed = self._type >= 0
+        self.flags[:, typed] &= ~cleared[:, self._type[typed]]
+
+        # the rules kept stay in order, followed by the rules added in the
+        # order they are read
+        kept = old & ~removed
+        key = np.where(kept, self.rule_order,
+                       np.where(added, len(RULES) + 1 + first_read, _NONE))
+        order = np.zeros_like(self.rule_order)
+        order[games[:, None], key.argsort(axis=1, kind='stable')] = \
+            np.arange(1, len(RULES) + 1)
+        self.rule_order = np.where(changed[:, None],
+                                   np.where(kept | added, order, 0),
+                                   self.rule_order)
+
+        # refresh the subjects whose rules changed, and the "isYou" subjects
+        # when the player is gone
+        refresh = np.zeros((self.size, len(_SUBJECTS)), bool)
+        you = _ATTRIBUTES.index("You")
+        for rule in range(len(RULES)):
+            refresh[:, rule_subject[rule]] |= removed[:, rule] \
+                | added[:, rule] \
+                | ((self.rule_order[:, rule] > 0) & (self.player < 0)
+                   & (rule_attribute[rule] == you))
+        refresh &= changed[:, None]
+
+        for position in range(1, int(self.rule_order.max(initial=0)) + 1):
+            at = self.rule_order == position
+            rule = at.argmax(axis=1)
+            subject = rule_subject[rule]
+            attribute = rule_attribute[rule]
+            applies = at.any(axis=1) & refresh[games, subject]
+            targets = instances[games, subject] & applies[:, None]
+
+            for word, (bit_set, bit_cleared) in _SETTERS.items():
+                chosen = targets & (attribute == _ATTRIBUTES.index(word))[
+                    :, None]
+                self.flags[chosen] = (self.flags[chosen] | bit_set) \
+                    & ~np.uint8(bit_cleared)
+
+            # the first actor of the subject becomes the player the game
+            # follows, unless the player is already of that type
+            player_type = self._type[np.maximum(self.player, 0)]
+            becomes = applies & (attribute == you) & targets.any(axis=1) \
+                & ((self.player < 0) | (player_type != subject))
+            first = np.where(targets, self._rank, _NONE).argmin(axis=1)
+            self.player[becomes] = first[becomes]
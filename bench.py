@@ -0,0 +1,253 @@
+"""
+Benchmarks of the main operations of the game on generated maps of
+increasing size.
+
+Each map has the rules "Meepo isYou", "Rock isPush" and "Wall isStop", a row
+of Is blocks every few rows, bushes, and the player in front of a long line
+of rocks to push. The timings are printed and, with the peak memory used to
+load each map, can be written as JSON, to compare a later run against and
+catch regressions, e.g.
+    python bench.py --output new.json --compare old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Draw without a window unless told otherwise
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+from settings import *
+from game import Game
+import actor
+
+# Only needed for the peak memory of the whole process, not on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# The width and height of the maps of each size
+SIZES = {"small": (16, 12), "medium": (64, 48), "large": (256, 192)}
+
+# How much slower than the compared run a benchmark can be before it is
+# reported as a regression
+TOLERANCE = 1.25
+
+
+def generate_map(width: int, height: int, seed: int = 0) -> str:
+    """
+    Return the text of a generated map of <width> x <height> tiles, at least
+    16 x 8.
+    """
+    rng = random.Random(seed)
+    rows = []
+    for y in range(height):
+        if y in (0, height - 1):
+            rows.append("3" * width)
+            continue
+        if y == 1:
+            inside = "MIY.RIP.WIS"
+        elif y == height // 2:
+            # the player and the line of rocks it pushes
+            inside = "2" + "4" * ((width - 2) // 2)
+        elif y % 4 == 3:
+            inside = "FIV." * (width // 4)
+        else:
+            inside = "".join("1" if rng.random() < 0.1 else "."
+                             for i in range(width - 2))
+        rows.append("3" + inside.ljust(width - 2, ".")[:width - 2] + "3")
+    return "\n".join(rows) + "\n"
+
+
+def load(path: str, headless: bool = True) -> Game:
+    """
+    Return a game of the map at <path>, with its rules applied.
+    """
+    game = Game(headless=headless)
+    game.load_map(path)
+    game.new()
+    game._update()
+    return game
+
+
+def measure(operation: Callable[[], Any], repeat: int,
+            setup: Optional[Callable[[], Any]] = None) -> Dict[str, float]:
+    """
+    Time <operation> <repeat> times, calling <setup> untimed before each run,
+    and return the mean and smallest duration, in seconds.
+    """
+    durations = []
+    for i in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        operation()
+        durations.append(time.perf_counter() - start)
+    return {"mean": sum(durations) / len(durations), "min": min(durations)}
+
+
+def bench_map(name: str, path: str, repeat: int) -> List[Dict[str, Any]]:
+    """
+    Run every benchmark on the map at <path>, of size <name>, and return
+    their results.
+    """
+    results = []
+
+    def record(benchmark: str, timing: Dict[str, float], **extra: Any) \
+            -> None:
+        results.append(dict(benchmark=benchmark, map=name, repeat=repeat,
+                            **timing, **extra))
+
+    # loading, and the memory it takes
+    tracemalloc.start()
+    game = load(path)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    record("new", measure(lambda: load(path), repeat),
+           actors=len(game.get_actors()), peak_memory=peak)
+
+    cells = [(random.randrange(game.x_tiles), random.randrange(game.y_tiles))
+             for i in range(10000)]
+    record("get_actor", measure(
+        lambda: [game.get_actor(x, y) for x, y in cells], repeat),
+        calls=len(cells))
+
+    # every run starts from the map as loaded, the player pushing the whole
+    # line of rocks
+    def restart() -> None:
+        while not game._history.is_empty():
+            game._undo()
+        game._history.push(game._save())
+
+    def push() -> None:
+        restart()
+        game.player.move(game, 1, 0)
+
+    def step() -> None:
+        restart()
+        game.step(1, 0)
+
+    def reread_rules() -> None:
+        game._rules_stale = True
+
+    chain = len(game.get_instances(actor.Rock))
+    record("move_push_chain", measure(
+        lambda: game.player.move(game, 1, 0), repeat, restart), chain=chain)
+    record("undo", measure(game._undo, repeat, step), chain=chain)
+    record("update_all_rules", measure(game._update, repeat, reread_rules),
+           is_blocks=len(game.get_is_blocks()))
+    record("update_after_move", measure(game._update, repeat, push))
+    record("copy", measure(game._copy, repeat))
+
+    # snapshots of the map as loaded and of one move away from it
+    base = game.snapshot()
+
+    def branch() -> None:
+        game.restore(base)
+        game.step(1, 0)
+
+    record("snapshot_after_move", measure(game.snapshot, repeat, branch))
+    record("restore_after_move",
+           measure(lambda: game.restore(base), repeat, branch))
+
+    # drawing, on the display SDL_VIDEODRIVER gives
+    game = load(path, headless=False)
+    record("draw", measure(game._draw, repeat))
+    game.set_dirty_rendering(True)
+    game._draw()
+    record("draw_dirty_after_move", measure(game._draw, repeat, step))
+    return results
+
+
+def run(sizes: List[str], repeat: int, directory: str) -> Dict[str, Any]:
+    """
+    Run the benchmarks on a generated map of each of <sizes>, written in
+    <directory>, and return the report.
+    """
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "results": []}
+    random.seed(0)
+    for name in sizes:
+        path = os.path.join(directory, "bench_{}.txt".format(name))
+        with open(path, "w") as f:
+            f.write(generate_map(*SIZES[name]))
+        report["results"].extend(bench_map(name, path, repeat))
+    if resource is not None:
+        report["max_rss_kb"] = \
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any],
+            tolerance: float = TOLERANCE) -> List[Tuple[str, str, float]]:
+    """
+    Return the benchmarks of <report> more than <tolerance> times slower
+    than in <baseline>, by their smallest duration, as (benchmark, map,
+    ratio).
+    """
+    before = {(i["benchmark"], i["map"]): i["min"]
+              for i in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        key = (result["benchmark"], result["map"])
+        if before.get(key):
+            ratio = result["min"] / before[key]
+            if ratio > tolerance:
+                regressions.append(key + (ratio,))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Run the benchmarks, write the report and compare it to a previous one.
+    Return 1 if a benchmark regressed, 0 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the main operations of the game.")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES),
+                        default=list(SIZES), help="the maps to benchmark")
+    parser.add_argument("--repeat", type=int, default=20,
+                        help="how many times each operation is timed")
+    parser.add_argument("--maps-dir", default=None,
+                        help="where the generated maps are written, by "
+                             "default a temporary directory")
+    parser.add_argument("--output", default=None,
+                        help="a file to write the report to as JSON")
+    parser.add_argument("--compare", default=None,
+                        help="a previous report to compare against")
+    args = parser.parse_args(argv)
+
+    if args.maps_dir is None:
+        with tempfile.TemporaryDirectory() as directory:
+            report = run(args.sizes, args.repeat, directory)
+    else:
+        report = run(args.sizes, args.repeat, args.maps_dir)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    for result in report["results"]:
+        print("{:<24}{:<8}{:>12.6f} ms".format(
+            result["benchmark"], result["map"], result["min"] * 1000))
+
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        regressions = compare(report, json.load(f))
+    for benchmark, name, ratio in regressions:
+        print("regression: {} on {} map is {:.2f}x slower".format(
+            benchmark, name, ratio))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+A compact representation of the state of a game, packed into a single flat
+buffer so that it can be copied, compared and hashed in one operation.
+
+The actors of the game stay the objects of actor.py: a Board refers to them
+by slot, and only stores what changes while playing (positions, flags, rules,
+player) as numbers.
+"""
+
+import struct
+from array import array
+from typing import List, Optional, Tuple
+from settings import *
+import actor
+
+# Every rule that can be formed, in a fixed order
+RULES = [subject + " is" + attribute
+         for subject in SUBJECTS.values() for attribute in ATTRIBUTES.values()]
+
+# The map tile of each character, e.g. "3" for a Wall, and of each word
+_CHARACTER_TILES = {name: tile for tile, name in CHARACTERS.items()}
+_SUBJECT_TILES = {word: tile for tile, word in SUBJECTS.items()}
+_ATTRIBUTE_TILES = {word: tile for tile, word in ATTRIBUTES.items()}
+
+
+def tile_of(actor_: actor.Actor) -> str:
+    """
+    Return the character representing <actor_> in a map file.
+    """
+    if isinstance(actor_, actor.Is):
+        return "I"
+    if isinstance(actor_, actor.Subject):
+        return _SUBJECT_TILES[actor_.word]
+    if isinstance(actor_, actor.Attribute):
+        return _ATTRIBUTE_TILES[actor_.word]
+    return _CHARACTER_TILES[type(actor_).__name__]
+
+
+class Board:
+    """
+    The state of a game as one flat buffer.
+
+    Each actor of the game has a slot in the board. The buffer holds, in
+    order: the x,y position of each slot as 16-bit integers ((-1, -1) once
+    the actor has been removed), the flags of each slot as a bitmask of
+    ATTRIBUTE_BITS, the position of each rule of RULES in the list of rules
+    of the game (0 if it is not a rule), the slot of the player (-1 if there
+    is none) and whether the game is still running.
+
+    === Public Attributes ===
+    width:
+        the number of tiles of the map on the x axis
+    height:
+        the number of tiles of the map on the y axis
+    actors:
+        the actor of each slot. It is shared by all the copies of a board.
+    tiles:
+        the map tile of the actor of each slot. It is shared by all the copies
+        of a board.
+
+    === Private Attributes ===
+    _buffer:
+        the state of the game
+    _positions:
+        the positions of the slots, viewed as 16-bit integers in _buffer
+    _flags:
+        the flags of the slots, viewed in _buffer
+    """
+    width: int
+    height: int
+    actors: Tuple[actor.Actor, ...]
+    tiles: str
+    _buffer: bytearray
+    _positions: memoryview
+    _flags: memoryview
+
+    def __init__(self, width: int, height: int,
+                 actors: Tuple[actor.Actor, ...], tiles: str) -> None:
+        """
+        Initialize an empty board for the given actors, all of them at (0, 0)
+        and without flags, rules or player.
+        """
+        self.width, self.height = width, height
+        self.actors = actors
+        self.tiles = tiles
+        self._set_buffer(bytearray(5 * len(actors) + len(RULES) + 5))
+        self.set_player(None)
+        self.set_running(True)
+
+    def _set_buffer(self, buffer: bytearray) -> None:
+        """
+        Use <buffer> as the state of this board.
+        """
+        n = len(self.actors)
+        self._buffer = buffer
+        self._positions = memoryview(buffer)[:4 * n].cast('h')
+        self._flags = memoryview(buffer)[4 * n:5 * n]
+
+    @classmethod
+    def from_game(cls, game_: 'Game',
+                  like: Optional['Board'] = None) -> 'Board':
+        """
+        Return the board of the current state of <game_>.
+
+        If <like> is given, the new board uses the same slots as <like>: the
+        actors of <like> that are no longer in the game are marked removed.
+        """
+        if like is None:
+            actors = tuple(game_.get_actors())
+            board = cls(game_.x_tiles, game_.y_tiles, actors,
+                        "".join(tile_of(i) for i in actors))
+        else:
+            board = cls(like.width, like.height, like.actors, like.tiles)
+
+        if len(game_.get_actors()) == len(board.actors):
+            # no actor has been removed
+            board._positions[:] = array('h', [
+                i for actor_ in board.actors for i in (actor_.x, actor_.y)])
+            board._flags[:] = bytes([actor_.get_flags()
+                                     for actor_ in board.actors])
+        else:
+            alive = set(map(id, game_.get_actors()))
+            for slot, actor_ in enumerate(board.actors):
+                if id(actor_) in alive:
+                    board.set_position(slot, (actor_.x, actor_.y))
+                    board._flags[slot] = actor_.get_flags()
+                else:
+                    board.set_position(slot, None)
+
+        board.set_rules(game_.get_rules())
+        if game_.player is not None:
+            board.set_player(board.actors.index(game_.player))
+        board.set_running(game_.get_running())
+        return board
+
+    def copy(self) -> 'Board':
+        """
+        Return a copy of this board, sharing its actors and tiles.
+        """
+        board = Board.__new__(Board)
+        board.width, board.height = self.width, self.height
+        board.actors = self.actors
+        board.tiles = self.tiles
+        board._set_buffer(bytearray(self._buffer))
+        return board
+
+    def key(self) -> bytes:
+        """
+        Return the state of this board as bytes, e.g. to use in a set.
+        """
+        return bytes(self._buffer)
+
+    def __eq__(self, other: object) -> bool:
+        """
+        Return whether <other> is a board of the same actors in the same state.
+        """
+        return isinstance(other, Board) and self.actors == other.actors \
+            and self._buffer == other._buffer
+
+    def __hash__(self) -> int:
+        """
+        Return the hash of the state of this board.
+        """
+        return hash(self.key())
+
+    def get_position(self, slot: int) -> Optional[Tuple[int, int]]:
+        """
+        Return the position of the actor of <slot>, or None if it has been
+        removed from the game.
+        """
+        if self._positions[2 * slot] < 0:
+            return None
+        return self._positions[2 * slot], self._positions[2 * slot + 1]
+
+    def set_position(self, slot: int, position: Optional[Tuple[int, int]]) \
+            -> None:
+        """
+        Set the position of the actor of <slot>, or mark it removed from the
+        game if <position> is None.
+        """
+        x, y = position if position is not None else (-1, -1)
+        self._positions[2 * slot] = x
+        self._positions[2 * slot + 1] = y
+
+    def get_flags(self, slot: int) -> int:
+        """
+        Return the flags of the actor of <slot> as a bitmask of ATTRIBUTE_BITS.
+        """
+        return self._flags[slot]
+
+    def set_flags(self, slot: int, flags: int) -> None:
+        """
+        Set the flags of the actor of <slot> to a bitmask of ATTRIBUTE_BITS.
+        """
+        self._flags[slot] = flags
+
+    def get_rules(self) -> List[str]:
+        """
+        Return the rules of the game, in the order they were formed.
+        """
+        start = 5 * len(self.actors)
+        order = self._buffer[start:start + len(RULES)]
+        return [RULES[i] for i in sorted((i for i in range(len(RULES))
+                                          if order[i]), key=order.__getitem__)]
+
+    def set_rules(self, rules: List[str]) -> None:
+        """
+        Set the rules of the game, in the order they were formed.
+        """
+        start = 5 * len(self.actors)
+        self._buffer[start:start + len(RULES)] = bytes(len(RULES))
+        for position, rule in enumerate(rules):
+            self._buffer[start + RULES.index(rule)] = position + 1
+
+    def get_player(self) -> Optional[int]:
+        """
+        Return the slot of the player, or None if there is no player.
+        """
+        slot = struct.unpack_from('<i', self._buffer,
+                                  len(self._buffer) - 5)[0]
+        return None if slot < 0 else slot
+
+    def set_player(self, slot: Optional[int]) -> None:
+        """
+        Set the slot of the player, or None if there is no player.
+        """
+        struct.pack_into('<i', self._buffer, len(self._buffer) - 5,
+                         -1 if slot is None else slot)
+
+    def get_running(self) -> bool:
+        """
+        Return whether the game is still running.
+        """
+        return bool(self._buffer[-1])
+
+    def set_running(self, running: bool) -> None:
+        """
+        Set whether the game is still running.
+        """
+        self._buffer[-1] = int(running)
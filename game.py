@@ -1,61 +1,172 @@
-from typing import Any, Type, Tuple, List, Sequence, Optional
-import pygame
+from typing import Any, Type, Tuple, List, Sequence, Optional, Dict, Set
+from functools import lru_cache
+import hashlib
+import time
 from settings import *
 from stack import Stack, EmptyStackError
+from history import Delta
+from board import Board, tile_of
+import mapfile
+import profiler
+import replay
+import snapshot
+from snapshot import Snapshot, Record
 import actor
+from actor import pygame
+
+# The class representing each subject word
+CHARACTER_TYPES = {"Meepo": actor.Meepo, "Wall": actor.Wall,
+                   "Rock": actor.Rock, "Flag": actor.Flag, "Bush": actor.Bush}
+
+# The actors drawn together in chunks of CHUNK_TILES tiles, since they never
+# move: no rule can name bushes, which always stop, so nothing is ever drawn
+# under or over them either
+STATIC_TYPES = (actor.Bush,)
+
+# A rule, as the type of its subject and the bit of its attribute
+Rule = Tuple[Type[actor.Actor], int]
+
+# Each rule that can be formed, by its name, e.g. "Wall isPush", and back
+RULE_KEYS = {subject + " is" + attribute:
+             (CHARACTER_TYPES[subject], ATTRIBUTE_BITS[attribute])
+             for subject in SUBJECTS.values()
+             for attribute in ATTRIBUTES.values()}
+RULE_NAMES = {key: rule for rule, key in RULE_KEYS.items()}
+
+_PUSH, _STOP = ATTRIBUTE_BITS["Push"], ATTRIBUTE_BITS["Stop"]
+_WIN, _LOSE = ATTRIBUTE_BITS["Victory"], ATTRIBUTE_BITS["Lose"]
+_YOU = ATTRIBUTE_BITS["You"]
+
+
+@lru_cache(maxsize=None)
+def zobrist(*parts: Any) -> int:
+    """
+    Return the random 64-bit number standing for <parts> of a game state in
+    the state hash, e.g. zobrist("3", 4, 5) for a Wall at (4, 5). The numbers
+    are the same in every process.
+    """
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
 
 
 class Game:
     """
     Class representing the game.
+
+    A headless game never opens a window nor loads an image: it only keeps the
+    state of the map, so it can be played through step() without pygame.
     """
+    headless: bool
     size: Tuple[int, int]
     width: int
     height: int
-    screen: Optional[pygame.Surface]
+    screen: Optional['pygame.Surface']
     x_tiles: int
     y_tiles: int
     tiles_number: Tuple[int, int]
-    background: Optional[pygame.Surface]
+    background: Optional['pygame.Surface']
+    view_tiles: Tuple[int, int]
+    view_size: Tuple[int, int]
+    camera: Tuple[int, int]
+    _atlas: Optional[actor.SpriteAtlas]
+    _chunks: Dict[Tuple[int, int], 'pygame.Surface']
+    _static_layer: Optional['pygame.Surface']
+    _redraw: Optional[Set[Tuple[int, int]]]
+    _latencies: List[float]
+    profiler: Optional[profiler.FrameProfiler]
+    _load_image_calls: int
+    _overlay_font: Optional['pygame.font.Font']
+    _replay: Optional[replay.Replay]
 
     _actors: List[actor.Actor]
+    _grid: Dict[Tuple[int, int], List[actor.Actor]]
+    _order: Dict[actor.Actor, int]
+    _registry: Dict[Type[actor.Actor], List[actor.Actor]]
     _is: List[actor.Is]
+    _is_rules: Dict[actor.Is, List[Rule]]
+    _dirty: Set[Tuple[int, int]]
+    _rules_stale: bool
     _running: bool
     _rules: List[str]
+    _rule_order: List[Rule]
+    _rule_bits: Dict[Type[actor.Actor], int]
     _history: Stack
+    _journal: Optional[Delta]
+    _tiles: Dict[actor.Actor, str]
+    _hash: int
+    _player: Optional[actor.Actor]
+    _snapshot: Optional[Snapshot]
+    _slots: Dict[actor.Actor, int]
+    _changed: Optional[Set[actor.Actor]]
 
-    player: Optional[actor.Actor]
     map_data: List[str]
     keys_pressed: Optional[Sequence[bool]]
+    check_index: bool
 
-    def __init__(self) -> None:
+    def __init__(self, headless: bool = False) -> None:
         """
         Initialize variables for this Class.
         """
+        self.headless = headless
         self.width, self.height = 0, 0
         self.size = (self.width, self.height)
         self.screen = None
         self.x_tiles, self.y_tiles = (0, 0)
         self.tiles_number = (self.x_tiles, self.y_tiles)
         self.background = None
+        self.view_tiles = (0, 0)
+        self.view_size = (0, 0)
+        self.camera = (0, 0)
+        self._atlas = None
+        self._chunks = {}
+        self._static_layer = None
+        self._redraw = None
+        self._latencies = []
+        self.profiler = None
+        self._load_image_calls = 0
+        self._overlay_font = None
+        self._replay = None
 
         self._actors = []
+        self._grid = {}
+        # The actors of each cell of the grid are kept in the order of
+        # self._actors, so that get_actor finds the first of them in it
+        self._order = {}
+        self._registry = {}
         self._is = []
+        self._is_rules = {}
+        self._dirty = set()
+        self._rules_stale = True
         self._running = True
         self._rules = []
+        self._rule_order = []
+        self._rule_bits = {}
         self._history = Stack()
+        self._journal = None
+        self._tiles = {}
+        self._hash = 0
 
-        self.player = None
+        self._player = None
+        # The last snapshot taken, the slot of each actor in it, and the
+        # actors changed since, or None until a snapshot is taken
+        self._snapshot = None
+        self._slots = {}
+        self._changed = None
         self.map_data = []
         self.keys_pressed = None
 
+        # When set, the grid index is verified against self._actors after
+        # every change to it (slow, meant for tests).
+        self.check_index = False
+
     def load_map(self, path: str) -> None:
         """
-        Reads a .txt file representing the map
+        Reads a .txt file representing the map, or its compiled map when it
+        has an up to date one, see mapfile.load_rows.
+
+        Raise mapfile.MapFormatError if the rows are not all as wide.
         """
-        with open(path, 'rt') as f:
-            for line in f:
-                self.map_data.append(line.strip())
+        self.map_data.extend(mapfile.load_rows(path))
 
         self.width = (len(self.map_data[0])) * TILESIZE
         self.height = len(self.map_data) * TILESIZE
@@ -65,28 +176,248 @@ class Game:
         # center the window on the screen
         os.environ['SDL_VIDEO_CENTERED'] = '1'
 
+    def stream_map(self, path: str,
+                   progress: Optional[mapfile.Progress] = None) -> None:
+        """
+        Load the map at <path> and create its actors, like load_map followed
+        by new, but reading the file one row at a time: the text of the map
+        is never kept, which matters for very large maps. <progress> is given
+        to mapfile.load_rows.
+
+        Raise mapfile.MapFormatError if the rows are not all as wide.
+        """
+        self.x_tiles = self.y_tiles = 0
+        self._snapshot = None
+        for col, tiles in enumerate(mapfile.load_rows(path, progress)):
+            for row, tile in enumerate(tiles):
+                self._add_tile(row, col, tile)
+            self.x_tiles, self.y_tiles = len(tiles), col + 1
+
+        self.tiles_number = (self.x_tiles, self.y_tiles)
+        self.width = self.x_tiles * TILESIZE
+        self.height = self.y_tiles * TILESIZE
+        self.size = (self.width, self.height)
+        os.environ['SDL_VIDEO_CENTERED'] = '1'
+        self._open_window()
+        self._rules_stale = True
+
     def new(self) -> None:
         """
         Initialize variables to be object on screen.
         """
-        self.screen = pygame.display.set_mode(self.size)
-        self.background = pygame.image.load(
-            "{}/backgroundBig.png".format(SPRITES_DIR)).convert_alpha()
+        self._open_window()
+        self._snapshot = None
         for col, tiles in enumerate(self.map_data):
             for row, tile in enumerate(tiles):
-                if tile.isnumeric():
-                    self._actors.append(
-                        Game.get_character(CHARACTERS[tile])(row, col))
-                elif tile in SUBJECTS:
-                    self._actors.append(
-                        actor.Subject(row, col, SUBJECTS[tile]))
-                elif tile in ATTRIBUTES:
-                    self._actors.append(
-                        actor.Attribute(row, col, ATTRIBUTES[tile]))
-                elif tile == 'I':
-                    is_tile = actor.Is(row, col)
-                    self._is.append(is_tile)
-                    self._actors.append(is_tile)
+                self._add_tile(row, col, tile)
+        self._rules_stale = True
+
+    def _open_window(self) -> None:
+        """
+        Open the window of the size of the map, or of VIEW_TILES if the map is
+        larger, and load the background, unless the game is headless.
+        """
+        self.view_tiles = (min(self.x_tiles, VIEW_TILES[0]),
+                           min(self.y_tiles, VIEW_TILES[1]))
+        self.view_size = (self.view_tiles[0] * TILESIZE,
+                          self.view_tiles[1] * TILESIZE)
+        self.camera = (0, 0)
+        if not self.headless:
+            self.screen = pygame.display.set_mode(self.view_size)
+            self.background = pygame.image.load(
+                "{}/backgroundBig.png".format(SPRITES_DIR)).convert_alpha()
+            actor.Meepo.load_sprites()
+            self._atlas = actor.SpriteAtlas()
+            self._chunks = {}
+            self._static_layer = None
+
+    def _add_tile(self, x: int, y: int, tile: str) -> None:
+        """
+        Add the actor represented by the character <tile> of a map at x,y,
+        if any.
+        """
+        if tile.isnumeric():
+            self.add_actor(Game.get_character(CHARACTERS[tile])(x, y))
+        elif tile in SUBJECTS:
+            self.add_actor(actor.Subject(x, y, SUBJECTS[tile]))
+        elif tile in ATTRIBUTES:
+            self.add_actor(actor.Attribute(x, y, ATTRIBUTES[tile]))
+        elif tile == 'I':
+            self.add_actor(actor.Is(x, y))
+
+    def add_actor(self, actor_: actor.Actor) -> None:
+        """
+        Add <actor_> to the game's list of actors and to the grid index.
+        """
+        self._actors.append(actor_)
+        if isinstance(actor_, actor.Is):
+            self._is.append(actor_)
+        self._registry.setdefault(type(actor_), []).append(actor_)
+        self._order[actor_] = len(self._order)
+        self._grid.setdefault((actor_.x, actor_.y), []).append(actor_)
+        self._dirty.add((actor_.x, actor_.y))
+        self._tiles[actor_] = tile_of(actor_)
+        self._hash ^= zobrist(self._tiles[actor_], actor_.x, actor_.y)
+        if self.check_index:
+            assert self.index_consistent()
+
+    def move_actor(self, actor_: actor.Actor, x: int, y: int) -> None:
+        """
+        Move <actor_> to the position x,y and update the grid index.
+        """
+        self._touch(actor_)
+        self._grid_discard(actor_)
+        self._dirty.add((actor_.x, actor_.y))
+        self._chunk_changed(actor_, actor_.x, actor_.y)
+        self._chunk_changed(actor_, x, y)
+        tile = self._tiles[actor_]
+        self._hash ^= zobrist(tile, actor_.x, actor_.y) ^ zobrist(tile, x, y)
+        if actor_ is self._player:
+            self._hash ^= zobrist("You", actor_.x, actor_.y) \
+                ^ zobrist("You", x, y)
+        actor_.x, actor_.y = x, y
+        self._grid_add(actor_)
+        self._dirty.add((x, y))
+        if self._redraw is not None:
+            self._redraw.add((x, y))
+        if self.check_index:
+            assert self.index_consistent()
+
+    def _touch(self, actor_: actor.Actor) -> None:
+        """
+        Record the position and state of <actor_> in the open delta, if any,
+        and mark its cell to be redrawn, before it is changed.
+        """
+        if self._journal is not None:
+            self._journal.touch(actor_)
+        if self._changed is not None:
+            self._changed.add(actor_)
+        if self._redraw is not None:
+            self._redraw.add((actor_.x, actor_.y))
+
+    def _grid_add(self, actor_: actor.Actor) -> None:
+        """
+        Add <actor_> to the grid cell at its current position, after the
+        actors that come before it in self._actors.
+        """
+        cell = self._grid.setdefault((actor_.x, actor_.y), [])
+        order = self._order[actor_]
+        i = len(cell)
+        while i > 0 and self._order[cell[i - 1]] > order:
+            i -= 1
+        cell.insert(i, actor_)
+
+    def _grid_discard(self, actor_: actor.Actor) -> None:
+        """
+        Remove <actor_> from the grid cell at its current position.
+        """
+        cell = self._grid[(actor_.x, actor_.y)]
+        cell.remove(actor_)
+        if not cell:
+            del self._grid[(actor_.x, actor_.y)]
+
+    def _rebuild_indexes(self) -> None:
+        """
+        Rebuild the grid index and the registry of actors by type from scratch
+        out of self._actors.
+        """
+        self._grid = {}
+        self._order = {actor_: i for i, actor_ in enumerate(self._actors)}
+        self._registry = {}
+        self._chunks = {}
+        for actor_ in self._actors:
+            self._grid.setdefault((actor_.x, actor_.y), []).append(actor_)
+            self._registry.setdefault(type(actor_), []).append(actor_)
+            if actor_ not in self._tiles:
+                self._tiles[actor_] = tile_of(actor_)
+        self._hash = self._compute_hash()
+
+    @property
+    def player(self) -> Optional[actor.Actor]:
+        """
+        The actor controlled by the key presses, or None.
+        """
+        return self._player
+
+    @player.setter
+    def player(self, actor_: Optional[actor.Actor]) -> None:
+        if self._player is not None:
+            self._hash ^= zobrist("You", self._player.x, self._player.y)
+        if actor_ is not None:
+            self._hash ^= zobrist("You", actor_.x, actor_.y)
+        self._player = actor_
+
+    def state_hash(self) -> int:
+        """
+        Return a 64-bit hash of the state of the game: where each actor is,
+        which one is the player and what the rules are. It is kept up to date
+        on every move and rule change, so getting it takes constant time.
+        """
+        return self._hash
+
+    def _compute_hash(self) -> int:
+        """
+        Return the hash of the state of the game, computed from scratch.
+        """
+        hash_ = 0
+        for actor_ in self._actors:
+            hash_ ^= zobrist(self._tiles[actor_], actor_.x, actor_.y)
+        for i, rule in enumerate(self._rule_order):
+            hash_ ^= zobrist("rule", RULE_NAMES[rule], i)
+        if self._player is not None:
+            hash_ ^= zobrist("You", self._player.x, self._player.y)
+        return hash_
+
+    def _set_rules(self, rules: List[str]) -> None:
+        """
+        Replace the list of rules by <rules>, given by their names, without
+        applying them.
+        """
+        self._set_rule_order([RULE_KEYS[rule] for rule in rules])
+
+    def _set_rule_order(self, rules: List[Rule]) -> None:
+        """
+        Replace the list of rules by <rules>, without applying them, and
+        update the bitmask of the rules of each subject and the names of the
+        rules to match.
+
+        Rules are hashed with their position, since the order they are
+        applied in decides the flags of their subjects.
+        """
+        for i, rule in enumerate(self._rule_order):
+            self._hash ^= zobrist("rule", RULE_NAMES[rule], i)
+        self._rule_order = list(rules)
+        self._rule_bits = {}
+        for i, (subject, bit) in enumerate(self._rule_order):
+            self._rule_bits[subject] = self._rule_bits.get(subject, 0) | bit
+            self._hash ^= zobrist("rule", RULE_NAMES[(subject, bit)], i)
+        self._rules = [RULE_NAMES[rule] for rule in self._rule_order]
+
+    def get_instances(self, cls: Type[actor.Actor]) -> List[actor.Actor]:
+        """
+        Return the actors in the game whose type is exactly <cls>, in the
+        order of the list of actors.
+        """
+        return self._registry.get(cls, [])
+
+    def index_consistent(self) -> bool:
+        """
+        Return whether the grid index holds exactly the actors of self._actors,
+        each one in the cell of its current position and in the order of
+        self._actors, whether the registry of actors by type matches
+        self._actors, and whether the state hash is up to date.
+        """
+        if self._hash != self._compute_hash():
+            return False
+        for cls, instances in self._registry.items():
+            if instances != [i for i in self._actors if type(i) is cls]:
+                return False
+        if sum(len(i) for i in self._registry.values()) != len(self._actors):
+            return False
+        cells = {}
+        for actor_ in self._actors:
+            cells.setdefault((actor_.x, actor_.y), []).append(actor_)
+        return cells == self._grid
 
     def get_actors(self) -> List[actor.Actor]:
         """
@@ -102,87 +433,557 @@ class Game:
 
     def get_rules(self) -> List[str]:
         """
-        Getter for _rules
+        Getter for _rules, the names of the rules in the order they were
+        formed, e.g. ["Meepo isYou", "Wall isStop"]
         """
         return self._rules
 
+    def has_rule(self, subject: Type[actor.Actor], attribute: str) -> bool:
+        """
+        Return whether there is a rule giving <attribute> to the actors of
+        the type <subject>, e.g. has_rule(Wall, "Push").
+        """
+        bit = ATTRIBUTE_BITS[attribute]
+        return bool(self._rule_bits.get(subject, 0) & bit)
+
     def get_is_blocks(self) -> List['Is']:
         """
         Getter for _is
         """
         return self._is
 
+    def set_dirty_rendering(self, enabled: bool) -> None:
+        """
+        Set whether _draw only redraws the tiles that changed since the last
+        frame, over a cached layer of the background and the static actors,
+        instead of the whole screen.
+        """
+        self._redraw = set() if enabled else None
+        self._static_layer = None
+
     def _draw(self) -> None:
         """
         Draws the screen, grid, and objects/players on the screen
         """
-        self.screen.blit(self.background,
-                         (((0.5 * self.width) - (0.5 * 1920),
-                           (0.5 * self.height) - (0.5 * 1080))))
-        for actor_ in self._actors:
-            rect = pygame.Rect(actor_.x * TILESIZE,
-                               actor_.y * TILESIZE, TILESIZE, TILESIZE)
-            self.screen.blit(actor_.image, rect)
+        if self._follow_player():
+            self._static_layer = None
+        if self._redraw is not None:
+            self._draw_dirty()
+            return
+
+        self.screen.blit(self.background, self._background_offset())
+        self._draw_chunks(self.screen)
+        self._draw_actors([actor_ for actor_ in self._visible_actors()
+                           if not isinstance(actor_, STATIC_TYPES)], True)
+        pygame.display.flip()
+
+    def _draw_actors(self, actors: List[actor.Actor], player: bool) -> None:
+        """
+        Draw <actors> on the screen from the sprite atlas, in one call, then
+        the player if <player>.
+        """
+        flags = pygame.BLEND_PREMULTIPLIED
+        blits = [(self._atlas.surface, self._screen_rect(i.x, i.y),
+                  self._atlas.area(i.sprite), flags) for i in actors]
 
         # Blit the player at the end to make it above all other objects
-        if self.player:
-            rect = pygame.Rect(self.player.x * TILESIZE,
-                               self.player.y * TILESIZE, TILESIZE, TILESIZE)
-            self.screen.blit(self.player.image, rect)
+        if player and self.player:
+            blits.append((self._atlas.surface,
+                          self._screen_rect(self.player.x, self.player.y),
+                          self._atlas.area(self.player.sprite), flags))
+        self.screen.blits(blits, doreturn=False)
 
-        pygame.display.flip()
+    def _chunk(self, cx: int, cy: int) -> 'pygame.Surface':
+        """
+        Return the surface of the chunk cx,cy: the walls and bushes of its
+        CHUNK_TILES x CHUNK_TILES tiles on a transparent background, with
+        colours premultiplied by alpha like the sprite atlas. It is drawn once
+        and kept until one of them moves.
+        """
+        chunk = self._chunks.get((cx, cy))
+        if chunk is not None:
+            return chunk
+
+        chunk = pygame.Surface((CHUNK_TILES * TILESIZE,
+                                CHUNK_TILES * TILESIZE), pygame.SRCALPHA)
+        flags = pygame.BLEND_PREMULTIPLIED
+        blits = []
+        for x in range(cx * CHUNK_TILES, (cx + 1) * CHUNK_TILES):
+            for y in range(cy * CHUNK_TILES, (cy + 1) * CHUNK_TILES):
+                for actor_ in self._grid.get((x, y), []):
+                    if isinstance(actor_, STATIC_TYPES):
+                        blits.append((self._atlas.surface,
+                                      ((x - cx * CHUNK_TILES) * TILESIZE,
+                                       (y - cy * CHUNK_TILES) * TILESIZE),
+                                      self._atlas.area(actor_.sprite), flags))
+        chunk.blits(blits, doreturn=False)
+        self._chunks[(cx, cy)] = chunk
+        return chunk
+
+    def _chunk_changed(self, actor_: actor.Actor, x: int, y: int) -> None:
+        """
+        Forget the chunk of the tile x,y if <actor_> is drawn in it, since
+        <actor_> is coming or going.
+        """
+        if self._chunks and isinstance(actor_, STATIC_TYPES):
+            self._chunks.pop((x // CHUNK_TILES, y // CHUNK_TILES), None)
+
+    def _draw_chunks(self, surface: 'pygame.Surface') -> None:
+        """
+        Draw the chunks in view on <surface>, which is the size of the screen.
+        """
+        left, top = self.camera
+        columns, rows = self.view_tiles
+        flags = pygame.BLEND_PREMULTIPLIED
+        surface.blits([(self._chunk(cx, cy),
+                        self._screen_rect(cx * CHUNK_TILES, cy * CHUNK_TILES),
+                        None, flags)
+                       for cy in range(top // CHUNK_TILES,
+                                       (top + rows - 1) // CHUNK_TILES + 1)
+                       for cx in range(left // CHUNK_TILES,
+                                       (left + columns - 1) // CHUNK_TILES
+                                       + 1)],
+                      doreturn=False)
+
+    def _follow_player(self) -> bool:
+        """
+        Move the camera so that the player is in the middle of the view, as
+        far as the edges of the map allow.
+        Returns whether the camera moved.
+        """
+        if self.player is None:
+            return False
+        columns, rows = self.view_tiles
+        camera = (max(0, min(self.player.x - columns // 2,
+                             self.x_tiles - columns)),
+                  max(0, min(self.player.y - rows // 2,
+                             self.y_tiles - rows)))
+        moved = camera != self.camera
+        self.camera = camera
+        return moved
+
+    def _in_view(self, x: int, y: int) -> bool:
+        """
+        Return whether the tile x,y is in the view.
+        """
+        return 0 <= x - self.camera[0] < self.view_tiles[0] \
+            and 0 <= y - self.camera[1] < self.view_tiles[1]
+
+    def _visible_actors(self) -> List[actor.Actor]:
+        """
+        Return the actors in the view, in the order they are drawn. When the
+        whole map is in view, these are all the actors, in the order of the
+        list of actors; otherwise, only the cells in view are looked up.
+        """
+        columns, rows = self.view_tiles
+        if columns >= self.x_tiles and rows >= self.y_tiles:
+            return self._actors
+        left, top = self.camera
+        return [actor_ for y in range(top, top + rows)
+                for x in range(left, left + columns)
+                for actor_ in self._grid.get((x, y), [])]
+
+    def _screen_rect(self, x: int, y: int) -> 'pygame.Rect':
+        """
+        Return the rectangle of the screen where the tile x,y is drawn.
+        """
+        return pygame.Rect((x - self.camera[0]) * TILESIZE,
+                           (y - self.camera[1]) * TILESIZE, TILESIZE, TILESIZE)
+
+    def _background_offset(self) -> Tuple[float, float]:
+        """
+        Return where the top left corner of the background is drawn, so that
+        the background is centered on the view. It does not scroll.
+        """
+        return ((0.5 * self.view_size[0]) - (0.5 * 1920),
+                (0.5 * self.view_size[1]) - (0.5 * 1080))
+
+    def _draw_static_tile(self, x: int, y: int) -> 'pygame.Rect':
+        """
+        Redraw the background and the static actors of the tile x,y on the
+        static layer, and return the rectangle of the tile on the screen.
+        """
+        rect = self._screen_rect(x, y)
+        offset_x, offset_y = self._background_offset()
+        self._static_layer.blit(self.background, rect,
+                                rect.move(-offset_x, -offset_y))
+        self._static_layer.blit(
+            self._chunk(x // CHUNK_TILES, y // CHUNK_TILES), rect,
+            pygame.Rect(x % CHUNK_TILES * TILESIZE, y % CHUNK_TILES * TILESIZE,
+                        TILESIZE, TILESIZE),
+            special_flags=pygame.BLEND_PREMULTIPLIED)
+        return rect
+
+    def _draw_dirty(self) -> None:
+        """
+        Draw the screen by only redrawing the tiles marked in self._redraw,
+        and update just those parts of the display. The whole screen is only
+        drawn on the first frame.
+        """
+        if self._static_layer is None:
+            self._static_layer = pygame.Surface(self.view_size)
+            self._static_layer.blit(self.background,
+                                    self._background_offset())
+            self._draw_chunks(self._static_layer)
+            self.screen.blit(self._static_layer, (0, 0))
+            self._draw_actors([actor_ for actor_ in self._visible_actors()
+                               if not isinstance(actor_, STATIC_TYPES)], True)
+            self._redraw = set()
+            pygame.display.flip()
+            return
+
+        if not self._redraw:
+            return
+        dirty_rects = []
+        actors = []
+        for x, y in self._redraw:
+            if not self._in_view(x, y):
+                continue
+            rect = self._draw_static_tile(x, y)
+            self.screen.blit(self._static_layer, rect, rect)
+            actors.extend(actor_ for actor_ in self._grid.get((x, y), [])
+                          if not isinstance(actor_, STATIC_TYPES))
+            dirty_rects.append(rect)
+        self._draw_actors(actors, self.player is not None and (
+            self.player.x, self.player.y) in self._redraw)
+        self._redraw = set()
+        pygame.display.update(dirty_rects)
 
     def _events(self) -> None:
         """
         Event handling of the game window
         """
         for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                self._running = False
-            # Allows us to make each press count as 1 movement.
-            elif event.type == pygame.KEYDOWN:
-                self.keys_pressed = pygame.key.get_pressed()
-                ctrl_held = self.keys_pressed[pygame.K_LCTRL]
-
-                # handle undo button and player movement here
-                if event.key == pygame.K_z and ctrl_held:  # Ctrl-Z
-                    self._undo()
-                else:
-                    if self.player is not None:
-                        assert isinstance(self.player, actor.Character)
-                        save = self._copy()
-                        if self.player.player_move(self) \
-                                and not self.win_or_lose():
-                            self._history.push(save)
+            self._handle_event(event)
         return
 
+    def _handle_event(self, event: 'pygame.event.Event') -> bool:
+        """
+        Handle a single event of the game window.
+        Returns True if it was a key press, which may have changed the game.
+        """
+        if event.type == pygame.QUIT:
+            self._running = False
+        # Allows us to make each press count as 1 movement.
+        elif event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_F3 and self.profiler is not None:
+                self.profiler.overlay = not self.profiler.overlay
+                return True
+            self.keys_pressed = pygame.key.get_pressed()
+            ctrl_held = self.keys_pressed[pygame.K_LCTRL]
+
+            # handle undo button and player movement here
+            if event.key == pygame.K_z and ctrl_held:  # Ctrl-Z
+                self._undo()
+                if self._replay is not None:
+                    self._replay.add(replay.UNDO)
+            else:
+                if self.player is not None:
+                    assert isinstance(self.player, actor.Character)
+                    dx, dy = actor.Character.handle_key_press(
+                        self.player, self)
+                    if self._replay is not None:
+                        self._replay.add(replay.MOVES[(dx, dy)])
+                    self._play_move(dx, dy)
+            return True
+        return False
+
     def win_or_lose(self) -> bool:
         """
         Check if the game has won or lost
         Returns True if the game is won or lost; otherwise return False
+
+        Each player is decided by the first actor of its tile that wins or
+        loses. The game is won if any player wins; otherwise every player
+        that loses is removed.
         """
-        assert isinstance(self.player, actor.Character)
-        for ac in self._actors:
-            if isinstance(ac, actor.Character) \
-                    and ac.x == self.player.x and ac.y == self.player.y:
-                if ac.is_win():
-                    self.win()
-                    return True
-                elif ac.is_lose():
-                    self.lose(self.player)
-                    return True
-        return False
+        lost = []
+        for player_ in self.get_players():
+            for ac in self._grid[(player_.x, player_.y)]:
+                if isinstance(ac, actor.Character):
+                    if ac.is_win():
+                        self.win()
+                        return True
+                    elif ac.is_lose():
+                        lost.append(player_)
+                        break
+        for player_ in lost:
+            self.lose(player_)
+        return bool(lost)
 
-    def run(self) -> None:
+    def run(self, event_driven: bool = False) -> None:
         """
         Run the Game until it ends or player quits.
+
+        If <event_driven>, the game sleeps until an event arrives instead of
+        waking up every frame: the rules are only evaluated and the screen
+        only drawn after a key press, and animation frames are drawn on their
+        own clock, FPS times a second.
         """
+        if event_driven:
+            self._run_event_driven()
+            return
+
         while self._running:
             pygame.time.wait(1000 // FPS)
             self._events()
             self._update()
             self._draw()
 
+    def _run_event_driven(self) -> None:
+        """
+        Run the Game, blocking on the event queue between frames, and record
+        the latency of each key press.
+        """
+        frame = 1000 // FPS
+        next_frame = pygame.time.get_ticks() + frame
+        self._update()
+        self._draw()
+        while self._running:
+            event = pygame.event.wait(
+                max(1, next_frame - pygame.time.get_ticks()))
+            if event.type != pygame.NOEVENT:
+                received = time.perf_counter()
+                pressed = False
+                for event in [event] + pygame.event.get():
+                    pressed = self._handle_event(event) or pressed
+                if pressed:
+                    self._update()
+                    self._draw()
+                    self._latencies.append(
+                        (time.perf_counter() - received) * 1000)
+
+            # animation frame
+            if pygame.time.get_ticks() >= next_frame:
+                self._draw()
+                next_frame = max(next_frame + frame,
+                                 pygame.time.get_ticks())
+
+    def enable_profiling(self, window: int = 300) -> profiler.FrameProfiler:
+        """
+        Start timing the events, update and draw phases of each frame, and
+        counting the calls to get_actor and load_image, keeping the last
+        <window> frames. A frame ends each time the screen is drawn. F3 shows
+        or hides an overlay of the timings.
+
+        The methods are only wrapped on this game while it is profiled, so a
+        game that is not profiled runs exactly as before.
+        Returns the profiler.
+        """
+        frames = profiler.FrameProfiler(window)
+        self.profiler = frames
+        stats = actor.sprite_cache_stats()
+        self._load_image_calls = stats["hits"] + stats["misses"]
+
+        def get_actor(x: int, y: int) -> Optional[actor.Actor]:
+            frames.count("get_actor")
+            return Game.get_actor(self, x, y)
+
+        self.get_actor = get_actor
+        self._handle_event = lambda event: frames.time(
+            "events", Game._handle_event, self, event)
+        self._update = lambda: frames.time("update", Game._update, self)
+        self._draw = self._draw_profiled
+        return frames
+
+    def disable_profiling(self) -> None:
+        """
+        Stop profiling this game.
+        """
+        for name in ("get_actor", "_handle_event", "_update", "_draw"):
+            self.__dict__.pop(name, None)
+        self.profiler = None
+
+    def _draw_profiled(self) -> None:
+        """
+        Draw the screen, and the overlay if it is shown, and end the frame of
+        the profiler.
+        """
+        self.profiler.time("draw", Game._draw, self)
+        if self.profiler.overlay:
+            self._draw_overlay()
+        stats = actor.sprite_cache_stats()
+        calls = stats["hits"] + stats["misses"]
+        self.profiler.end_frame(load_image=calls - self._load_image_calls,
+                                history=self._history.size())
+        self._load_image_calls = calls
+
+    def _draw_overlay(self) -> None:
+        """
+        Draw the lines of the overlay of the profiler in the top left corner
+        of the screen.
+        """
+        if self._overlay_font is None:
+            pygame.font.init()
+            self._overlay_font = pygame.font.Font(None, 18)
+        font = self._overlay_font
+        lines = self.profiler.overlay_lines()
+        height = font.get_linesize()
+        rect = pygame.Rect(0, 0, max(font.size(i)[0] for i in lines) + 8,
+                           height * len(lines) + 8)
+        panel = pygame.Surface(rect.size, pygame.SRCALPHA)
+        panel.fill((0, 0, 0, 160))
+        self.screen.blit(panel, rect)
+        for i, line in enumerate(lines):
+            self.screen.blit(font.render(line, True, WHITE),
+                             (4, 4 + i * height))
+        pygame.display.update(rect)
+
+        # the tiles under the overlay are drawn again on the next frame
+        if self._redraw is not None:
+            self._redraw.update(
+                (self.camera[0] + x, self.camera[1] + y)
+                for x in range(rect.width // TILESIZE + 1)
+                for y in range(rect.height // TILESIZE + 1))
+
+    def get_input_latency(self) -> Dict[str, float]:
+        """
+        Return statistics, in milliseconds, of the time from taking a key press
+        off the event queue to the screen showing its result, for the key
+        presses handled by the event driven loop: their number, mean, median
+        and maximum.
+
+        In the event driven loop a key press is taken off the queue as soon as
+        it arrives; in the other loop it may wait up to 1000 // FPS ms more.
+        """
+        latencies = sorted(self._latencies)
+        if not latencies:
+            return {"count": 0, "mean": 0.0, "median": 0.0, "max": 0.0}
+        return {"count": len(latencies),
+                "mean": sum(latencies) / len(latencies),
+                "median": latencies[len(latencies) // 2],
+                "max": latencies[-1]}
+
+    def start_recording(self, map_path: Optional[str] = None) \
+            -> replay.Replay:
+        """
+        Start recording every key press and undo handled by the game, from
+        its current state, in which <map_path> was loaded.
+        Returns the replay being recorded.
+        """
+        self._replay = replay.Replay(self.state_hash(), map_path)
+        return self._replay
+
+    def stop_recording(self) -> replay.Replay:
+        """
+        Stop recording and return the replay recorded.
+        """
+        recorded = self._replay
+        assert recorded is not None, "the game is not being recorded"
+        recorded.stop(self.state_hash())
+        self._replay = None
+        return recorded
+
+    def play_replay(self, replay_: replay.Replay) -> bool:
+        """
+        Play every action of <replay_> again, as fast as possible and without
+        drawing anything, updating the rules at the end of each frame like
+        the game loop does.
+
+        Raise ValueError if the game is not in the state the recording started
+        from, e.g. if it was made on another map.
+        Returns whether the game ends in the state the recording stopped in.
+        """
+        if self.state_hash() != replay_.start_hash:
+            raise ValueError("The replay was not recorded from this state.")
+        for frame in replay_.frames:
+            for action in frame:
+                if action == replay.UNDO:
+                    self._undo()
+                else:
+                    self._play_move(*DIRECTIONS.get(action, (0, 0)))
+            self._update()
+        return self.state_hash() == replay_.final_hash
+
+    def step(self, dx: int, dy: int, record: bool = True) -> bool:
+        """
+        Move the player by dx and dy the way a key press does, without
+        needing a window: the move can be undone, the game is checked for a
+        win or a loss, and the rules are updated.
+
+        If not <record>, the move is not recorded for undo as a move of its
+        own: its changes are added to the open delta, if any, so that they
+        are undone together with the move before it.
+
+        Returns whether the player actually moved.
+        """
+        moved = self._play_move(dx, dy, record)
+        self._update()
+        return moved
+
+    def _play_move(self, dx: int, dy: int, record: bool = True) -> bool:
+        """
+        Move the players like step(), without updating the rules.
+        """
+        moved = False
+        if self.player is not None:
+            save = self._save() if record else None
+            moved = self._move_players(dx, dy)
+            if moved and not self.win_or_lose() and record:
+                self._history.push(save)
+        return moved
+
+    def _move_players(self, dx: int, dy: int) -> bool:
+        """
+        Turn every player towards dx and dy, and move them all by dx and dy,
+        starting with the one furthest along the move so that it gets out of
+        the way of the players behind it. Players sharing a tile move in the
+        order of the list of actors.
+
+        Returns whether any player moved.
+        """
+        players = sorted(self.get_players(), key=lambda player_: (
+            -(player_.x * dx + player_.y * dy),
+            self._grid[(player_.x, player_.y)].index(player_)))
+        moved = False
+        for player_ in players:
+            assert isinstance(player_, actor.Character)
+            self._touch(player_)
+            player_.face(dx, dy)
+            if dx != 0 or dy != 0:
+                moved = player_.move(self, dx, dy, player_) or moved
+        return moved
+
+    def apply_moves(self, moves: Sequence[Any], record: bool = True) -> int:
+        """
+        Play <moves> in order, each one like a key press through step(), and
+        stop early as soon as the game is won or lost. A move is either a
+        letter of DIRECTIONS, so <moves> can be a string like "RRUL", or a
+        (dx, dy) pair.
+
+        If not <record>, the moves are not recorded for undo as moves of their
+        own, which makes them faster to play: undoing the move made before
+        them undoes them too, see step().
+
+        Returns the number of moves played.
+        """
+        played = 0
+        for move in moves:
+            if not self._running or self.player is None:
+                break
+            if isinstance(move, str):
+                if move not in DIRECTIONS:
+                    raise ValueError("Unknown move: {!r}".format(move))
+                move = DIRECTIONS[move]
+            self.step(move[0], move[1], record)
+            played += 1
+        return played
+
+    def get_players(self) -> List[actor.Actor]:
+        """
+        Return every actor moved by the key presses: the actors with the
+        "You" flag of the subjects of the "isYou" rules, and the player the
+        game follows, even if a later rule took the flag away from it.
+        """
+        players = []
+        for subject, bit in self._rule_order:
+            if bit == _YOU:
+                players.extend(actor_ for actor_ in self.get_instances(subject)
+                               if actor_.is_player())
+        if self.player is not None and not self.player.is_player():
+            players.append(self.player)
+        return players
+
     def set_player(self, actor_: Optional[actor.Actor]) -> None:
         """
         Takes an actor and sets that actor to be the player
@@ -193,8 +994,20 @@ class Game:
         """
         Remove the given <actor> from the game's list of actors.
         """
+        if self._journal is not None:
+            self._journal.remove(actor_, self._actors.index(actor_))
+        if self._changed is not None:
+            self._changed.add(actor_)
         self._actors.remove(actor_)
-        self.player = None
+        self._registry[type(actor_)].remove(actor_)
+        self._grid_discard(actor_)
+        self._hash ^= zobrist(self._tiles[actor_], actor_.x, actor_.y)
+        self._dirty.add((actor_.x, actor_.y))
+        self._chunk_changed(actor_, actor_.x, actor_.y)
+        if actor_ is self.player:
+            self.player = None
+        if self.check_index:
+            assert self.index_consistent()
 
     def _update(self) -> None:
         """
@@ -219,133 +1032,210 @@ class Game:
 
         # - Update self._rules to the new list of rules.
 
-        # Gets a list of the most updated "is" rule blocks
+        if self._replay is not None:
+            self._replay.end_frame()
+
+        # Nothing moved since the last update, so the rules cannot change
+        if not self._dirty and not self._rules_stale:
+            return
 
-        current_rules = []
-        updated_rules = []
-        remove_rules = []
+        # 1. Re-reads the "is" blocks next to a changed cell, or all of them
+        # when the cached rules cannot be trusted
+        if self._rules_stale:
+            self._is_rules = {}
+            changed_is = self._is
+        else:
+            changed_is = self._is_near_dirty()
+        self._dirty = set()
 
-        # 1. Gets all the current rules
-        for is_tile in self._is:
+        for is_tile in changed_is:
             up = self.get_actor(is_tile.x, is_tile.y - 1)
             down = self.get_actor(is_tile.x, is_tile.y + 1)
             left = self.get_actor(is_tile.x - 1, is_tile.y)
             right = self.get_actor(is_tile.x + 1, is_tile.y)
+            self._touch(is_tile)
+            rules = is_tile.update(up, down, left, right)
+            self._is_rules[is_tile] = [RULE_KEYS[rule] for rule in rules
+                                       if rule != ""]
+
+        # Gets all the current rules, as a bitmask of attributes per subject,
+        # in the order they are read
+        current = {}
+        read = []
+        for is_tile in self._is:
+            for subject, bit in self._is_rules[is_tile]:
+                if not current.get(subject, 0) & bit:
+                    current[subject] = current.get(subject, 0) | bit
+                    read.append((subject, bit))
+
+        # 1 a) finds the attributes removed from each subject
+        removed = {}
+        for subject, bits in self._rule_bits.items():
+            if bits & ~current.get(subject, 0):
+                removed[subject] = bits & ~current.get(subject, 0)
+
+        # 1 b) Find the attributes added to each subject
+        added = {}
+        for subject, bits in current.items():
+            if bits & ~self._rule_bits.get(subject, 0):
+                added[subject] = bits & ~self._rule_bits.get(subject, 0)
+
+        # Remove all old rules' effects
+        for subject, bits in removed.items():
+            for current_actor in self.get_instances(subject):
+                self._touch(current_actor)
+
+                if bits & _PUSH:
+                    current_actor.unset_push()
+                if bits & _STOP:
+                    current_actor.unset_stop()
+                if bits & _WIN:
+                    current_actor.unset_win()
+                if bits & _LOSE:
+                    current_actor.unset_lose()
+                if bits & _YOU:
+                    current_actor.unset_player()
+                    self.player = None
+
+        # Updates the rules, the ones kept staying in order followed by the
+        # new ones
+        if removed or added:
+            self._set_rule_order(
+                [(subject, bit) for subject, bit in self._rule_order
+                 if not removed.get(subject, 0) & bit]
+                + [(subject, bit) for subject, bit in read
+                   if added.get(subject, 0) & bit])
 
-            rule_up_down = is_tile.update(up, down, left, right)[0]
-            rule_left_right = is_tile.update(up, down, left, right)[1]
-
-            if rule_up_down != "":
-                current_rules.append(rule_up_down)
-            if rule_left_right != "":
-                current_rules.append(rule_left_right)
-
-        # 1 a) finds removed rules and place it into <rules> list
-        for rule in self.get_rules():
-            if rule not in current_rules:
-                remove_rules.append(rule)
-
-        # 1 b) Find new rules
-        for rule in current_rules:
-            if rule not in self.get_rules():
-                updated_rules.append(rule)
-
-        # Remove old rules
-        for rule in remove_rules:
-            old_subject = rule[:rule.index(' is')]
-            old_attribute = rule[rule.find(' is') + 3:]
-
-            # Remove all old rules' effects
-            for current_actor in self._actors:
-                if isinstance(current_actor, self.get_character(old_subject)):
-
-                    if old_attribute == "Push":
-                        current_actor.unset_push()
-                    if old_attribute == "Stop":
-                        current_actor.unset_stop()
-                    if old_attribute == "Victory":
-                        current_actor.unset_win()
-                    if old_attribute == "Lose":
-                        current_actor.unset_lose()
-                    if old_attribute == "You":
-                        current_actor.unset_player()
-                        self.player = None
-
-        # Updates self.rules by removing old rules
-        for rule in remove_rules:
-            if rule in self.get_rules():
-                self.get_rules().remove(rule)
-
-        # Updates self.rules with newly added rules
-        for rule in updated_rules:
-            if rule not in self.get_rules():
-                self.get_rules().append(rule)
-
-        # Refreshes rules
-        for rule in self.get_rules():
-            update_subject = rule[:rule.index(' is')]
-            update_attribute = rule[rule.find(' is') + 3:]
-
-            for current_actor in self._actors:
-                if isinstance(current_actor,
-                              self.get_character(update_subject)):
-
-                    if update_attribute == "Push":
-                        current_actor.set_push()
-                    if update_attribute == "Stop":
-                        current_actor.set_stop()
-                    if update_attribute == "Victory":
-                        current_actor.set_win()
-                    if update_attribute == "Lose":
-                        current_actor.set_lose()
-                    if update_attribute == "You" \
-                            and not isinstance(current_actor,
-                                               type(self.player)):
-                        current_actor.set_player()
+        # Refreshes the rules of the subjects whose rules changed. Every
+        # subject is refreshed after a full re-read, and the "isYou" subjects
+        # whenever the player is gone.
+        refresh = set(removed) | set(added)
+        for subject, bit in self._rule_order:
+            if self._rules_stale or (bit == _YOU and self.player is None):
+                refresh.add(subject)
+        self._rules_stale = False
+
+        for subject, bit in self._rule_order:
+            if subject not in refresh:
+                continue
+
+            for current_actor in self.get_instances(subject):
+                self._touch(current_actor)
+
+                if bit == _PUSH:
+                    current_actor.set_push()
+                if bit == _STOP:
+                    current_actor.set_stop()
+                if bit == _WIN:
+                    current_actor.set_win()
+                if bit == _LOSE:
+                    current_actor.set_lose()
+                # every actor of the subject is a player, and the first one
+                # becomes the player the game follows, unless the player is
+                # already of that type
+                if bit == _YOU:
+                    current_actor.set_player()
+                    if not isinstance(current_actor, type(self.player)):
                         self.player = current_actor
 
         return
 
+    def _is_near_dirty(self) -> List[actor.Is]:
+        """
+        Return the "is" blocks standing on, or next to, a cell that changed
+        since the last update.
+        """
+        near = []
+        for x, y in self._dirty:
+            for cell in ((x, y), (x - 1, y), (x + 1, y), (x, y - 1),
+                         (x, y + 1)):
+                for actor_ in self._grid.get(cell, []):
+                    if isinstance(actor_, actor.Is) and actor_ not in near:
+                        near.append(actor_)
+        return near
+
     @staticmethod
     def get_character(subject: str) -> Optional[Type[Any]]:
         """
         Takes a string, returns appropriate class representing that string
         """
-        if subject == "Meepo":
-            return actor.Meepo
-        elif subject == "Wall":
-            return actor.Wall
-        elif subject == "Rock":
-            return actor.Rock
-        elif subject == "Flag":
-            return actor.Flag
-        elif subject == "Bush":
-            return actor.Bush
-        return None
+        return CHARACTER_TYPES.get(subject)
+
+    def _save(self) -> Delta:
+        """
+        Start recording the changes made to the game from now on into a new
+        delta, and return it. Pushing the delta onto the _history stack makes
+        the game undoable back to this point.
+
+        The changes of a delta that was never pushed, e.g. of a move that
+        lost one of several players, are added to the delta at the top of the
+        stack, so that undoing it still brings back everything they changed.
+        """
+        if self._journal is not None and not self._history.is_empty():
+            top = self._history.peek()
+            if top is not self._journal:
+                top.absorb(self._journal)
+        self._journal = Delta(self.player, self._rule_order)
+        if self.player is not None:
+            # the player's image may change even if it cannot move
+            self._journal.touch(self.player)
+        return self._journal
 
     def _undo(self) -> None:
         """
         Returns the game to a previous state based on what is at the top of the
         _history stack.
+
+        The rules are not all read again: the actors moved back or brought
+        back mark their cells dirty, so the next _update only re-reads the
+        rules around them, as after a move.
         """
-        # Restores old player, actors and is blocks' locations
+        # Reverts the changes made since the save point at the top of the
+        # stack, including the ones made after it that were never pushed
         try:
-            old_data = self._history.pop()
-            self.player = old_data.player
-            self._actors = old_data.get_actors()
-            self._is = old_data.get_is_blocks()
+            delta = self._history.pop()
+            if self._journal is not None and self._journal is not delta:
+                self._revert(self._journal)
+            self._revert(delta)
+            self._journal = Delta(self.player, self._rule_order)
             return
 
         # Error Handling
         except EmptyStackError:
-            print("Cannot undo.")
+            if not self.headless:
+                print("Cannot undo.")
+
+    def _revert(self, delta: Delta) -> None:
+        """
+        Bring back the actors, player and rules recorded in <delta> to how they
+        were at its save point.
+        """
+        self._journal = None
+        if self._changed is not None:
+            self._changed.update(delta.actors)
+        for removed, index in reversed(delta.removed):
+            self._actors.insert(index, removed)
+            self._registry[type(removed)] = [
+                i for i in self._actors if type(i) is type(removed)]
+            self._grid_add(removed)
+            self._dirty.add((removed.x, removed.y))
+            self._chunk_changed(removed, removed.x, removed.y)
+            self._hash ^= zobrist(self._tiles[removed], removed.x, removed.y)
+        for touched, (x, y, state) in delta.actors.items():
+            if (touched.x, touched.y) != (x, y):
+                self.move_actor(touched, x, y)
+            touched.restore_state(state)
+            if self._redraw is not None:
+                self._redraw.add((x, y))
+        self.player = delta.player
+        self._set_rule_order(delta.rules)
 
     def _copy(self) -> 'Game':
         """
         Copies relevant attributes of the game onto a new instance of Game.
         Return new instance of game
         """
-        game_copy = Game()
+        game_copy = Game(self.headless)
 
         actors_copy = []
         is_blocks_copy = []
@@ -363,41 +1253,219 @@ class Game:
 
         game_copy._actors = actors_copy
         game_copy._is = is_blocks_copy
+        game_copy._rebuild_indexes()
 
         return game_copy
 
+    def get_board(self, like: Optional[Board] = None) -> Board:
+        """
+        Return the current state of the game as a Board. If <like> is given,
+        the board uses the same slots as <like>.
+        """
+        return Board.from_game(self, like)
+
+    def load_board(self, board: Board) -> None:
+        """
+        Bring the game to the state recorded in <board>, which must have been
+        taken from this game. The undo history is cleared.
+        """
+        self._journal = None
+        self._history = Stack()
+        if self._changed is not None:
+            self._changed.update(board.actors)
+
+        alive = [actor_ for slot, actor_ in enumerate(board.actors)
+                 if board.get_position(slot) is not None]
+        if alive != self._actors:
+            changed = set(map(id, alive)) ^ set(map(id, self._actors))
+            for actor_ in alive + self._actors:
+                if id(actor_) in changed:
+                    self._dirty.add((actor_.x, actor_.y))
+            self._actors = alive
+            self._rebuild_indexes()
+            self._static_layer = None
+
+        for slot, actor_ in enumerate(board.actors):
+            position = board.get_position(slot)
+            if position is None:
+                continue
+            if actor_.x != position[0] or actor_.y != position[1]:
+                self.move_actor(actor_, *position)
+            actor_.set_flags(board.get_flags(slot))
+
+        player = board.get_player()
+        self.player = None if player is None else board.actors[player]
+        self._set_rules(board.get_rules())
+        self._running = board.get_running()
+
+    def snapshot(self) -> Snapshot:
+        """
+        Return a snapshot of the current state of the game, to bring it back
+        later with restore(), e.g. to branch out while searching or to try
+        moves out.
+
+        Snapshots share their storage: only the records of the actors changed
+        since the last snapshot are copied, so taking one after a move takes
+        time proportional to what the move changed, not to the size of the
+        map. The first snapshot of a map records every actor.
+        """
+        last = self._snapshot
+        if last is None or any(actor_ not in self._slots
+                               for actor_ in self._changed):
+            actors = tuple(self._actors)
+            self._slots = {actor_: slot for slot, actor_ in enumerate(actors)}
+            root, shift = snapshot.build([self._record(actor_)
+                                          for actor_ in actors])
+        else:
+            actors, shift = last.actors, last.shift
+            root = snapshot.update(last.root, shift, {
+                self._slots[actor_]: self._record(actor_)
+                for actor_ in self._changed})
+        self._snapshot = Snapshot(
+            actors, root, shift, self.player, tuple(self._rule_order),
+            self._running, self._hash)
+        self._changed = set()
+        return self._snapshot
+
+    def _record(self, actor_: actor.Actor) -> Record:
+        """
+        Return the position and flags of <actor_>, or snapshot.REMOVED if it
+        is no longer in the game.
+        """
+        cell = self._grid.get((actor_.x, actor_.y), [])
+        if not any(i is actor_ for i in cell):
+            return snapshot.REMOVED
+        return actor_.x, actor_.y, actor_.get_flags()
+
+    def restore(self, snapshot_: Snapshot) -> None:
+        """
+        Bring the game back to the state of <snapshot_>, taken from this
+        game. The undo history is cleared.
+
+        Only the actors whose record differs between the current state and
+        <snapshot_> are changed, and the records the two share are not even
+        compared.
+        """
+        current = self.snapshot()
+        self._journal = None
+        self._history = Stack()
+        actors = snapshot_.actors
+        if current.actors is actors:
+            changes = list(snapshot.diff(current.root, snapshot_.root,
+                                         snapshot_.shift))
+        else:
+            # the actors of the game were replaced since
+            changes = list(enumerate(snapshot.records(snapshot_.root,
+                                                      snapshot_.shift)))
+            self._slots = {actor_: slot for slot, actor_ in enumerate(actors)}
+
+        if current.actors is not actors or any(
+                (record == snapshot.REMOVED)
+                != (self._record(actors[slot]) == snapshot.REMOVED)
+                for slot, record in changes):
+            alive = [actor_ for actor_, record in zip(
+                actors, snapshot.records(snapshot_.root, snapshot_.shift))
+                if record != snapshot.REMOVED]
+            changed = set(map(id, alive)) ^ set(map(id, self._actors))
+            for actor_ in alive + self._actors:
+                if id(actor_) in changed:
+                    self._dirty.add((actor_.x, actor_.y))
+            self._actors = alive
+            self._rebuild_indexes()
+            self._static_layer = None
+
+        for slot, (x, y, flags) in changes:
+            actor_ = actors[slot]
+            if (x, y, flags) == snapshot.REMOVED:
+                continue
+            if actor_.x != x or actor_.y != y:
+                self.move_actor(actor_, x, y)
+            actor_.set_flags(flags)
+
+        self.player = snapshot_.player
+        self._set_rule_order(list(snapshot_.rules))
+        self._running = snapshot_.running
+        self._snapshot = snapshot_
+        self._changed = set()
+        if self.check_index:
+            assert self.index_consistent()
+
     def get_actor(self, x: int, y: int) -> Optional[actor.Actor]:
         """
         Return the actor at the position x,y. If the slot is empty, Return None
+        If several actors are stacked on the slot, the bottom one is returned.
         """
-        for ac in self._actors:
-            if ac.x == x and ac.y == y:
-                return ac
+        cell = self._grid.get((x, y))
+        if cell:
+            return cell[0]
         return None
 
+    def get_actors_at(self, x: int, y: int) -> List[actor.Actor]:
+        """
+        Return all the actors stacked at the position x,y, bottom first.
+        """
+        return list(self._grid.get((x, y), []))
+
     def win(self) -> None:
         """
         End the game and print win message.
         """
         self._running = False
-        print("Congratulations, you won!")
+        if not self.headless:
+            print("Congratulations, you won!")
 
     def lose(self, char: actor.Character) -> None:
         """
         Lose the game and print lose message
         """
         self.remove_player(char)
-        print("You lost! But you can have it undone if undo is done :)")
+        if not self.headless:
+            print("You lost! But you can have it undone if undo is done :)")
 
 
 if __name__ == "__main__":
+    import argparse
+    import sys
+    parser = argparse.ArgumentParser(description="Play Meepo is You.")
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="time each frame, show the timings (F3 hides "
+                             "them) and write them to FILE when the game "
+                             "ends")
+    parser.add_argument("--record", metavar="FILE", default=None,
+                        help="record every key press to FILE, to play the "
+                             "game again with --replay")
+    parser.add_argument("--replay", metavar="FILE", default=None,
+                        help="play a recorded game again without a window, "
+                             "and check it ends in the same state")
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        recorded = replay.load(args.replay)
+        game = Game(headless=True)
+        game.load_map(recorded.map_path or MAP_PATH)
+        game.new()
+        start = time.perf_counter()
+        same = game.play_replay(recorded)
+        print("Replayed {} actions in {:.1f} ms: {}".format(
+            len(recorded), (time.perf_counter() - start) * 1000,
+            "same final state" if same else "DIFFERENT final state"))
+        sys.exit(0 if same else 1)
 
     try:
         game = Game()
         # load_map public function
         game.load_map(MAP_PATH)
         game.new()
-        game.run()
+        game.set_dirty_rendering(True)
+        if args.profile is not None:
+            game.enable_profiling().overlay = True
+        if args.record is not None:
+            game.start_recording(MAP_PATH)
+        game.run(event_driven=True)
+        if args.profile is not None:
+            game.profiler.dump(args.profile)
+        if args.record is not None:
+            game.stop_recording().save(args.record)
     except EmptyStackError:
         print("Error. Cannot undo.")
 
@@ -0,0 +1,62 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class Delta:
+    """
+    The changes made to a game since a save point, recorded so that the game
+    can be brought back to the save point by undoing them.
+
+    Only the actors touched after the save point are recorded, so the size of
+    a delta is proportional to what changed rather than to the whole game.
+
+    === Public Attributes ===
+    player:
+        the player of the game at the save point
+    rules:
+        the rules of the game at the save point, in order
+    actors:
+        for each actor touched since the save point, its position and its
+        state (flags and image) at the save point
+    removed:
+        the actors removed from the game since the save point, with their
+        index in the game's list of actors, in the order they were removed
+    """
+    player: Optional[Any]
+    rules: List[Any]
+    actors: Dict[Any, Tuple[int, int, tuple]]
+    removed: List[Tuple[Any, int]]
+
+    def __init__(self, player: Optional[Any], rules: List[Any]) -> None:
+        """
+        Initialize an empty delta for a save point with the given <player>
+        and <rules>.
+        """
+        self.player = player
+        self.rules = list(rules)
+        self.actors = {}
+        self.removed = []
+
+    def touch(self, actor_: Any) -> None:
+        """
+        Record the position and state of <actor_>, unless it has already been
+        recorded since the save point.
+        """
+        if actor_ not in self.actors:
+            self.actors[actor_] = (actor_.x, actor_.y, actor_.save_state())
+
+    def remove(self, actor_: Any, index: int) -> None:
+        """
+        Record that <actor_> was removed from position <index> of the game's
+        list of actors.
+        """
+        self.touch(actor_)
+        self.removed.append((actor_, index))
+
+    def absorb(self, later: 'Delta') -> None:
+        """
+        Add the changes recorded in <later>, a delta whose save point came
+        after this one, so that reverting this delta reverts them too.
+        """
+        for actor_, saved in later.actors.items():
+            self.actors.setdefault(actor_, saved)
+        self.removed.extend(later.removed)
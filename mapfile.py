@@ -0,0 +1,231 @@
+"""
+Reading the map files of the game.
+
+A map file has one row of tiles per line, all rows of the same width. Each
+tile is a character of CHARACTERS, SUBJECTS or ATTRIBUTES in settings.py, "I"
+for an Is block, or anything else, usually ".", for an empty tile.
+
+Maps can also be compiled to a binary file, with the extension COMPILED next
+to the text file, which is mapped in memory instead of being parsed: a
+HEADER with the width and height of the map, then a byte per tile, row by
+row, holding the character of the tile. To compile maps, run e.g.
+    python mapfile.py maps/*.txt
+"""
+
+import argparse
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from typing import Callable, Iterator, List, Optional
+
+# Called with the number of rows and of bytes read so far, and the size of
+# the file in bytes
+Progress = Callable[[int, int, int], None]
+
+# The extension of compiled maps, and their header: a magic string, the
+# version of the format, the width and the height of the map
+COMPILED = ".map"
+HEADER = struct.Struct("<4sBII")
+MAGIC = b"MEEP"
+VERSION = 1
+
+
+class MapFormatError(ValueError):
+    """
+    Raised when a map file is not a grid of tiles.
+    """
+    pass
+
+
+def read_rows(path: str, progress: Optional[Progress] = None,
+              every: int = 1024) -> Iterator[str]:
+    """
+    Yield the rows of tiles of the map at <path> one at a time, reading the
+    file in buffered chunks rather than all at once. Blank lines at the end of
+    the file are ignored.
+
+    If <progress> is given, it is called after every <every> rows and once at
+    the end.
+
+    Raise MapFormatError as soon as a row is not as wide as the first one.
+    """
+    total = os.path.getsize(path)
+    width = None
+    rows = read = blank = 0
+    with open(path, 'rb') as f:
+        for line in f:
+            read += len(line)
+            tiles = line.strip().decode('ascii')
+            if not tiles:
+                blank += 1
+                continue
+            if width is None:
+                width = len(tiles)
+            elif blank or len(tiles) != width:
+                raise MapFormatError(
+                    "{}: row {} has {} tiles, expected {}".format(
+                        path, rows + 1, 0 if blank else len(tiles), width))
+            rows += 1
+            yield tiles
+            if progress is not None and rows % every == 0:
+                progress(rows, read, total)
+    if width is None:
+        raise MapFormatError("{}: the map is empty".format(path))
+    if progress is not None:
+        progress(rows, read, total)
+
+
+class CompiledMap:
+    """
+    A compiled map, mapped in memory: its tiles are only read from the file
+    when they are used.
+
+    === Public Attributes ===
+    width:
+        the number of tiles of each row
+    height:
+        the number of rows
+
+    === Private Attributes ===
+    _mmap:
+        the file of the map, mapped in memory
+    _tiles:
+        the tiles of the map, viewed in _mmap without copying them
+    """
+    width: int
+    height: int
+    _mmap: mmap.mmap
+    _tiles: memoryview
+
+    def __init__(self, path: str) -> None:
+        """
+        Map the compiled map at <path> in memory.
+
+        Raise MapFormatError if it is not a compiled map.
+        """
+        if os.path.getsize(path) < HEADER.size:
+            raise MapFormatError("{}: not a compiled map".format(path))
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.width, self.height = \
+            HEADER.unpack_from(self._mmap)
+        if magic != MAGIC or version != VERSION \
+                or len(self._mmap) != HEADER.size + self.width * self.height:
+            self._mmap.close()
+            raise MapFormatError("{}: not a compiled map".format(path))
+        self._tiles = memoryview(self._mmap)[HEADER.size:]
+
+    def row(self, y: int) -> memoryview:
+        """
+        Return the tiles of row <y>, as a view of the file that must be
+        released before the map is closed.
+        """
+        return self._tiles[y * self.width:(y + 1) * self.width]
+
+    def rows(self) -> Iterator[str]:
+        """
+        Yield the rows of tiles of the map one at a time.
+        """
+        for y in range(self.height):
+            yield self.row(y).tobytes().decode('ascii')
+
+    def to_text(self) -> str:
+        """
+        Return the map in the text format.
+        """
+        return "".join(row + "\n" for row in self.rows())
+
+    def close(self) -> None:
+        """
+        Unmap the file of this map.
+        """
+        self._tiles.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'CompiledMap':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
+
+
+def compiled_path(path: str) -> str:
+    """
+    Return the path of the compiled map of the text map at <path>.
+    """
+    return os.path.splitext(path)[0] + COMPILED
+
+
+def compile_map(path: str, output: Optional[str] = None) -> str:
+    """
+    Compile the text map at <path> to <output>, by default next to it, and
+    return the path of the compiled map.
+    """
+    output = output or compiled_path(path)
+    width = height = 0
+    # the map is compiled to a temporary file replacing <output> once it is
+    # complete, so that a map failing to compile leaves no compiled map that
+    # load_rows would read instead of the text
+    fd, temporary = tempfile.mkstemp(
+        suffix=COMPILED, dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # the header is written once the size of the map is known
+            f.write(bytes(HEADER.size))
+            for tiles in read_rows(path):
+                f.write(tiles.encode('ascii'))
+                width, height = len(tiles), height + 1
+            f.seek(0)
+            f.write(HEADER.pack(MAGIC, VERSION, width, height))
+        os.replace(temporary, output)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    return output
+
+
+def load_rows(path: str, progress: Optional[Progress] = None) \
+        -> Iterator[str]:
+    """
+    Yield the rows of tiles of the map at <path>, from its compiled map if
+    <path> is one, or if it has one that is not older than the text. Fall
+    back to read_rows otherwise.
+    """
+    compiled = path if path.endswith(COMPILED) else compiled_path(path)
+    if os.path.exists(compiled) and (
+            compiled == path or not os.path.exists(path)
+            or os.path.getmtime(compiled) >= os.path.getmtime(path)):
+        with CompiledMap(compiled) as compiled_map:
+            yield from compiled_map.rows()
+        if progress is not None:
+            size = os.path.getsize(compiled)
+            progress(compiled_map.height, size, size)
+    else:
+        yield from read_rows(path, progress)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Compile the text maps given on the command line, or print compiled maps
+    back as text.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compile maps of the game to a binary format.")
+    parser.add_argument("maps", nargs="+", help="map files")
+    parser.add_argument("--text", action="store_true",
+                        help="print compiled maps as text")
+    args = parser.parse_args(argv)
+
+    for path in args.maps:
+        if args.text:
+            with CompiledMap(path) as compiled_map:
+                sys.stdout.write(compiled_map.to_text())
+        else:
+            print("{} -> {}".format(path, compile_map(path)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Timings and counters of the frames of a game, to find out what makes a
+frame slow. See Game.enable_profiling.
+"""
+
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+# The parts of a frame that are timed
+PHASES = ("events", "update", "draw")
+
+# What is counted in each frame: calls to Game.get_actor and to
+# actor.load_image, and the number of moves that can be undone
+COUNTERS = ("get_actor", "load_image", "history")
+
+# The upper bounds of the buckets of the histograms of frame times, in
+# milliseconds
+BUCKETS = (1, 2, 4, 8, 16, 33, 66, 100, float("inf"))
+
+
+class FrameProfiler:
+    """
+    The timings and counters of the last frames of a game.
+
+    === Public Attributes ===
+    frames:
+        the last frames, oldest first: for each one, the seconds spent in
+        each of PHASES and in all of them ("total"), and its COUNTERS
+    overlay:
+        whether the game draws a summary of the frames on the screen
+
+    === Private Attributes ===
+    _current:
+        the timings and counters of the frame in progress
+    """
+    frames: Deque[Dict[str, float]]
+    overlay: bool
+    _current: Dict[str, float]
+
+    def __init__(self, window: int = 300) -> None:
+        """
+        Initialize a profiler keeping the last <window> frames.
+        """
+        self.frames = deque(maxlen=window)
+        self.overlay = False
+        self._new_frame()
+
+    def _new_frame(self) -> None:
+        """
+        Start a new frame.
+        """
+        self._current = dict.fromkeys(PHASES + COUNTERS, 0)
+
+    def time(self, phase: str, function: Callable, *args: Any) -> Any:
+        """
+        Call <function> with <args>, adding its duration to <phase> of the
+        frame in progress, and return its result.
+        """
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self._current[phase] += time.perf_counter() - start
+
+    def count(self, counter: str, n: int = 1) -> None:
+        """
+        Add <n> to <counter> of the frame in progress.
+        """
+        self._current[counter] += n
+
+    def end_frame(self, **counters: int) -> None:
+        """
+        Record the frame in progress, with the given values of counters, and
+        start a new one.
+        """
+        self._current.update(counters)
+        self._current["total"] = sum(self._current[i] for i in PHASES)
+        self.frames.append(self._current)
+        self._new_frame()
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return the mean and the largest value of each phase, in milliseconds,
+        and of each counter over the last frames.
+        """
+        result = {}
+        for key in PHASES + ("total",) + COUNTERS:
+            values = [frame[key] for frame in self.frames]
+            scale = 1 if key in COUNTERS else 1000
+            result[key] = {
+                "mean": scale * sum(values) / len(values) if values else 0.0,
+                "max": scale * max(values, default=0.0)}
+        return result
+
+    def histogram(self, phase: str = "total") -> List[Tuple[float, int]]:
+        """
+        Return how many of the last frames spent a duration in <phase> within
+        each bucket of BUCKETS, as (upper bound in ms, count).
+        """
+        counts = [0] * len(BUCKETS)
+        for frame in self.frames:
+            milliseconds = frame[phase] * 1000
+            counts[next(i for i, bound in enumerate(BUCKETS)
+                        if milliseconds <= bound)] += 1
+        return list(zip(BUCKETS, counts))
+
+    def overlay_lines(self) -> List[str]:
+        """
+        Return the lines of text of the overlay: the mean and largest time of
+        each phase, the counters of the last frame and the histogram of frame
+        times.
+        """
+        summary = self.summary()
+        last = self.frames[-1] if self.frames else self._current
+        lines = ["{:<7}{:>7.2f} ms {:>7.2f} max".format(
+            key, summary[key]["mean"], summary[key]["max"])
+            for key in PHASES + ("total",)]
+        lines.append("  ".join("{} {}".format(key, int(last[key]))
+                               for key in COUNTERS))
+        for bound, count in self.histogram():
+            label = "<={:>4} ms".format(bound) if bound != float("inf") \
+                else "> {:>4} ms".format(BUCKETS[-2])
+            lines.append("{} {}".format(
+                label, "#" * round(30 * count / max(len(self.frames), 1))))
+        return lines
+
+    def dump(self, path: str) -> None:
+        """
+        Write the summary, the histograms and the last frames as JSON to the
+        file at <path>.
+        """
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(),
+                       "histograms": {
+                           phase: [(None if bound == float("inf") else bound,
+                                    count)
+                                   for bound, count in self.histogram(phase)]
+                           for phase in PHASES + ("total",)},
+                       "frames": list(self.frames)},
+                      f, indent=2)
@@ -0,0 +1,142 @@
+"""
+Recordings of the inputs of a game, to play a session again exactly, e.g. to
+reproduce a bug. See Game.start_recording and Game.play_replay.
+
+A replay is saved as a single line of JSON: the map played, the state hash
+of the game when the recording started and when it stopped, the actions of
+each frame as a string, frames separated by spaces, and the time of each
+action in milliseconds, each one relative to the previous action.
+"""
+
+import json
+import time
+from typing import List, Optional
+
+from settings import DIRECTIONS
+
+# The action of an undo, and of a key press that moves nowhere
+UNDO = "Z"
+NO_MOVE = "."
+
+# The action of each move by (dx, dy)
+MOVES = {move: letter for letter, move in DIRECTIONS.items()}
+MOVES[(0, 0)] = NO_MOVE
+
+VERSION = 1
+
+
+class Replay:
+    """
+    The inputs of a game session, in the frames they were handled in.
+
+    The rules of the game are updated once at the end of each frame, so the
+    actions of a frame are played one after the other before it.
+
+    === Public Attributes ===
+    map_path:
+        the path of the map played, if known
+    start_hash:
+        the state hash of the game when the recording started
+    final_hash:
+        the state hash of the game when the recording stopped, or None while
+        it is recording
+    frames:
+        the actions of each frame, in order: a letter of DIRECTIONS for a
+        move, UNDO, or NO_MOVE
+    times:
+        when each action was made, in milliseconds since the recording
+        started
+
+    === Private Attributes ===
+    _start:
+        the time the recording started, from time.perf_counter
+    _current:
+        the actions of the frame in progress
+    """
+    map_path: Optional[str]
+    start_hash: int
+    final_hash: Optional[int]
+    frames: List[str]
+    times: List[int]
+    _start: float
+    _current: List[str]
+
+    def __init__(self, start_hash: int,
+                 map_path: Optional[str] = None) -> None:
+        """
+        Initialize a recording of a game in the state of hash <start_hash>.
+        """
+        self.map_path = map_path
+        self.start_hash = start_hash
+        self.final_hash = None
+        self.frames = []
+        self.times = []
+        self._start = time.perf_counter()
+        self._current = []
+
+    def __len__(self) -> int:
+        """
+        Return the number of actions recorded.
+        """
+        return len(self.times)
+
+    def add(self, action: str) -> None:
+        """
+        Record <action> in the frame in progress.
+        """
+        self._current.append(action)
+        self.times.append(round((time.perf_counter() - self._start) * 1000))
+
+    def end_frame(self) -> None:
+        """
+        End the frame in progress. Frames without actions are only kept at
+        the start, since updating the rules again without any action in
+        between changes nothing.
+        """
+        if self._current or not self.frames:
+            self.frames.append("".join(self._current))
+            self._current = []
+
+    def stop(self, final_hash: int) -> None:
+        """
+        Stop recording, the game being in the state of hash <final_hash>.
+        """
+        if self._current:
+            self.end_frame()
+        self.final_hash = final_hash
+
+    def save(self, path: str) -> None:
+        """
+        Write this replay to the file at <path>.
+        """
+        deltas = [now - before
+                  for before, now in zip([0] + self.times, self.times)]
+        with open(path, "w") as f:
+            json.dump({"version": VERSION, "map": self.map_path,
+                       "start": "{:016x}".format(self.start_hash),
+                       "final": None if self.final_hash is None
+                       else "{:016x}".format(self.final_hash),
+                       "frames": " ".join(self.frames), "times": deltas},
+                      f, separators=(",", ":"))
+            f.write("\n")
+
+
+def load(path: str) -> Replay:
+    """
+    Return the replay saved in the file at <path>.
+
+    Raise ValueError if it is not a replay.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or data.get("version") != VERSION:
+        raise ValueError("{}: not a replay".format(path))
+    replay = Replay(int(data["start"], 16), data["map"])
+    if data["final"] is not None:
+        replay.final_hash = int(data["final"], 16)
+    replay.frames = data["frames"].split(" ")
+    total = 0
+    for delta in data["times"]:
+        total += delta
+        replay.times.append(total)
+    return replay
@@ -24,10 +24,24 @@ FPS = 10
 TITLE = "Base Game"
 TILESIZE = 35
 
+# The most tiles shown at once on the x and y axis: the view scrolls over
+# larger maps
+VIEW_TILES = (32, 20)
+
+# The size in tiles of the squares of the map whose walls and bushes are
+# drawn together
+CHUNK_TILES = 16
+
 SUBJECTS = {"W": "Wall", "R": "Rock", "F": "Flag", "M": "Meepo"}
 ATTRIBUTES = {"P": "Push", "S": "Stop", "V": "Victory", "L": "Lose", "Y": "You"}
 CHARACTERS = {"1": "Bush", "2": "Meepo", "3": "Wall", "4": "Rock", "5": "Flag"}
 
+# Offsets (dx, dy) of the moves of the player, in the order the keys are read
+DIRECTIONS = {"L": (-1, 0), "R": (1, 0), "U": (0, -1), "D": (0, 1)}
+
+# Bit of each attribute in the bitmasks of flags and rules
+ATTRIBUTE_BITS = {"Push": 1, "Stop": 2, "Victory": 4, "Lose": 8, "You": 16}
+
 BASE_DIR = "."
 SPRITES_DIR = "{}/sprites".format(BASE_DIR)
 MAP_PATH = "{}/maps/student_map5.txt".format(BASE_DIR)
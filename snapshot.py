@@ -0,0 +1,152 @@
+"""
+Snapshots of the state of a game that share their storage with each other.
+
+The position and flags of every actor are kept in a persistent vector: a
+tree of tuples, each node holding up to WIDTH children, with one record per
+actor in the leaves. A tree is never changed once built: updating records
+copies only the nodes on the paths to them, so a snapshot taken after a move
+shares every other node with the snapshot before it, and comparing two
+snapshots skips the nodes they share. See Game.snapshot and Game.restore.
+"""
+
+from typing import Any, Dict, Iterator, Optional, Sequence, Tuple
+
+# The number of bits of a slot used at each level of the tree, and the number
+# of children of each node
+BITS = 5
+WIDTH = 1 << BITS
+MASK = WIDTH - 1
+
+# The position and flags of an actor, or REMOVED once it has been removed
+# from the game
+Record = Tuple[int, int, int]
+REMOVED = (-1, -1, 0)
+
+
+def build(records: Sequence[Record]) -> Tuple[tuple, int]:
+    """
+    Return the root of a tree holding <records>, in order, and the shift of
+    the slot giving the child of the root to go down to.
+    """
+    shift = 0
+    while WIDTH << shift < len(records):
+        shift += BITS
+    return _build(records, shift), shift
+
+
+def _build(records: Sequence[Record], shift: int) -> tuple:
+    """
+    Return the node holding <records> at the level of <shift>.
+    """
+    if shift == 0:
+        return tuple(records)
+    size = WIDTH << (shift - BITS)
+    return tuple(_build(records[i:i + size], shift - BITS)
+                 for i in range(0, len(records), size))
+
+
+def update(node: tuple, shift: int, changes: Dict[int, Record]) -> tuple:
+    """
+    Return the node <node> at the level of <shift> with the record of each
+    slot of <changes> replaced. Nodes where nothing changes are returned as
+    they are, so they stay shared.
+    """
+    children = list(node)
+    changed = False
+    if shift == 0:
+        for slot, record in changes.items():
+            if children[slot & MASK] != record:
+                children[slot & MASK] = record
+                changed = True
+    else:
+        groups = {}
+        for slot, record in changes.items():
+            groups.setdefault((slot >> shift) & MASK, {})[slot] = record
+        for i, group in groups.items():
+            children[i] = update(node[i], shift - BITS, group)
+            changed = changed or children[i] is not node[i]
+    return tuple(children) if changed else node
+
+
+def records(node: tuple, shift: int) -> Iterator[Record]:
+    """
+    Yield every record of the tree under <node>, in order.
+    """
+    if shift == 0:
+        yield from node
+    else:
+        for child in node:
+            yield from records(child, shift - BITS)
+
+
+def diff(old: tuple, new: tuple, shift: int, offset: int = 0) \
+        -> Iterator[Tuple[int, Record]]:
+    """
+    Yield the slot and the record in <new> of each record that differs
+    between the trees <old> and <new> of the same slots, skipping the nodes
+    they share.
+    """
+    if old is new:
+        return
+    if shift == 0:
+        for i, (before, after) in enumerate(zip(old, new)):
+            if before != after:
+                yield offset + i, after
+    else:
+        for i, (before, after) in enumerate(zip(old, new)):
+            yield from diff(before, after, shift - BITS, offset + (i << shift))
+
+
+class Snapshot:
+    """
+    The state of a game at some point, which never changes.
+
+    === Public Attributes ===
+    actors:
+        the actor of each slot, shared by the snapshots of a game taken
+        since its actors were last replaced
+    root:
+        the tree of the record of each slot
+    shift:
+        the shift of the slot at the root of the tree
+    player:
+        the player the game follows
+    rules:
+        the rules of the game, in order
+    running:
+        whether the game is still running
+    hash:
+        the state hash of the game
+    """
+    actors: Tuple[Any, ...]
+    root: tuple
+    shift: int
+    player: Optional[Any]
+    rules: Tuple[Any, ...]
+    running: bool
+    hash: int
+
+    def __init__(self, actors: Tuple[Any, ...], root: tuple, shift: int,
+                 player: Optional[Any], rules: Tuple[Any, ...],
+                 running: bool, hash_: int) -> None:
+        """
+        Initialize a snapshot of the given state.
+        """
+        self.actors = actors
+        self.root = root
+        self.shift = shift
+        self.player = player
+        self.rules = rules
+        self.running = running
+        self.hash = hash_
+
+    def get_record(self, slot: int) -> Record:
+        """
+        Return the record of <slot>.
+        """
+        node = self.root
+        shift = self.shift
+        while shift > 0:
+            node = node[(slot >> shift) & MASK]
+            shift -= BITS
+        return node[slot & MASK]
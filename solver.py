@@ -0,0 +1,215 @@
+"""
+A solver for the levels of the game.
+
+It searches the moves of the player from the start of a map, playing them on
+a headless Game so that pushing, rules and winning or losing work exactly as
+in the game. States already seen are recognized by the state hash of the game
+and skipped, and the first win found by the breadth-first search uses the
+fewest moves.
+
+Run it on map files to check that they can be won, e.g.
+    python solver.py maps/*.txt --max-nodes 200000 --time-limit 60
+"""
+
+import argparse
+import heapq
+import itertools
+import sys
+import time
+from collections import deque
+from typing import List, Optional, Tuple
+from settings import *
+from snapshot import Snapshot
+from game import Game
+import actor
+
+# The statuses a search can end with
+SOLVED = "solved"
+UNSOLVABLE = "unsolvable"
+NODE_LIMIT = "node limit"
+TIME_LIMIT = "time limit"
+
+
+class SolveResult:
+    """
+    The outcome of solving a map, with statistics about the search.
+
+    === Public Attributes ===
+    status:
+        SOLVED, UNSOLVABLE if every reachable state was searched without a
+        win, or NODE_LIMIT or TIME_LIMIT if the search was cut short
+    moves:
+        the winning moves found, as letters of DIRECTIONS, e.g. "RRDL", or
+        None if no win was found
+    expanded:
+        the number of states whose moves were tried
+    generated:
+        the number of new states reached
+    duplicates:
+        the number of moves leading to a state already reached
+    max_frontier:
+        the largest number of states waiting to be expanded
+    elapsed:
+        the duration of the search, in seconds
+    """
+    status: str
+    moves: Optional[str]
+    expanded: int
+    generated: int
+    duplicates: int
+    max_frontier: int
+    elapsed: float
+
+    def __init__(self) -> None:
+        """
+        Initialize the result of a search that has not started.
+        """
+        self.status = UNSOLVABLE
+        self.moves = None
+        self.expanded = 0
+        self.generated = 0
+        self.duplicates = 0
+        self.max_frontier = 0
+        self.elapsed = 0.0
+
+    def __str__(self) -> str:
+        """
+        Return a one-line summary of this result.
+        """
+        summary = "{} in {:.2f}s: {} expanded, {} generated, {} duplicates, " \
+                  "frontier {}".format(self.status, self.elapsed,
+                                       self.expanded, self.generated,
+                                       self.duplicates, self.max_frontier)
+        if self.moves is not None:
+            summary += ", {} moves: {}".format(len(self.moves), self.moves)
+        return summary
+
+
+def load_game(path: str) -> Game:
+    """
+    Return a headless game of the map at <path>, with its rules applied.
+    """
+    game = Game(headless=True)
+    game.load_map(path)
+    game.new()
+    game._update()
+    return game
+
+
+def distance_to_win(game: Game) -> int:
+    """
+    Return the Manhattan distance from the player to the nearest actor that
+    wins the game, or 0 if there is no such actor.
+    """
+    if game.player is None:
+        return 0
+    distances = [abs(i.x - game.player.x) + abs(i.y - game.player.y)
+                 for i in game.get_actors()
+                 if isinstance(i, actor.Character) and i.is_win()]
+    return min(distances, default=0)
+
+
+def solve(game: Game, max_nodes: Optional[int] = None,
+          time_limit: Optional[float] = None,
+          astar: bool = False) -> SolveResult:
+    """
+    Search for the shortest sequence of moves winning <game> from its current
+    state. The game is left in an unspecified state.
+
+    The search stops after expanding <max_nodes> states or running for
+    <time_limit> seconds, if given. With <astar>, states closer to a winning
+    actor are expanded first: the search is usually faster, but the moves
+    found may not be the fewest when rules have to change to win.
+    """
+    result = SolveResult()
+    start_time = time.perf_counter()
+
+    root = game.snapshot()
+    seen = {game.state_hash()}
+    counter = itertools.count()
+    # frontier of (priority, tie breaker, state, moves)
+    frontier: List[Tuple[int, int, Snapshot, str]] = []
+    queue = deque()
+    if astar:
+        heapq.heappush(frontier, (distance_to_win(game), next(counter), root,
+                                  ""))
+    else:
+        queue.append((root, ""))
+
+    while frontier or queue:
+        if max_nodes is not None and result.expanded >= max_nodes:
+            result.status = NODE_LIMIT
+            break
+        if time_limit is not None \
+                and time.perf_counter() - start_time > time_limit:
+            result.status = TIME_LIMIT
+            break
+
+        if astar:
+            state, moves = heapq.heappop(frontier)[2:]
+        else:
+            state, moves = queue.popleft()
+        result.expanded += 1
+
+        for direction, (dx, dy) in DIRECTIONS.items():
+            # every move starts from <state>: a move losing one of several
+            # players is not recorded for undo, so the moves are not undone
+            game.restore(state)
+            if not game.step(dx, dy):
+                continue
+            if not game.get_running():
+                result.status = SOLVED
+                result.moves = moves + direction
+                result.elapsed = time.perf_counter() - start_time
+                return result
+            if game.player is None:
+                # lost: nothing can be done from here
+                continue
+
+            key = game.state_hash()
+            if key in seen:
+                result.duplicates += 1
+                continue
+            seen.add(key)
+            child = game.snapshot()
+            result.generated += 1
+            if astar:
+                heapq.heappush(frontier,
+                               (len(moves) + 1 + distance_to_win(game),
+                                next(counter), child, moves + direction))
+            else:
+                queue.append((child, moves + direction))
+        result.max_frontier = max(result.max_frontier,
+                                  len(frontier) + len(queue))
+
+    result.elapsed = time.perf_counter() - start_time
+    return result
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Solve the maps given on the command line and print the results.
+    Return 0 if every map was solved, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check that maps of the game can be won.")
+    parser.add_argument("maps", nargs="+", help="map files to solve")
+    parser.add_argument("--max-nodes", type=int, default=None,
+                        help="stop after expanding this many states")
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="stop after this many seconds per map")
+    parser.add_argument("--astar", action="store_true",
+                        help="expand the states closest to a win first")
+    args = parser.parse_args(argv)
+
+    all_solved = True
+    for path in args.maps:
+        result = solve(load_game(path), args.max_nodes, args.time_limit,
+                       args.astar)
+        print("{}: {}".format(path, result))
+        all_solved = all_solved and result.status == SOLVED
+    return 0 if all_solved else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,16 @@ class Stack:
         """
         return self._items == []
 
+    def size(self) -> int:
+        """Return the number of items in this stack.
+
+        >>> s = Stack()
+        >>> s.push('hello')
+        >>> s.size()
+        1
+        """
+        return len(self._items)
+
     def push(self, item: Any) -> None:
         """Add a new element to the top of this stack."""
         self._items.append(item)
@@ -49,6 +59,24 @@ class Stack:
         else:
             return self._items.pop()
 
+    def peek(self) -> Any:
+        """Return the element at the top of this stack without removing it.
+
+        Raise an EmptyStackError if this stack is empty.
+
+        >>> s = Stack()
+        >>> s.push('hello')
+        >>> s.push('goodbye')
+        >>> s.peek()
+        'goodbye'
+        >>> s.size()
+        2
+        """
+        if self.is_empty():
+            raise EmptyStackError
+        else:
+            return self._items[-1]
+
 
 class EmptyStackError(Exception):
     """Exception raised when an error occurs."""
@@ -1,8 +1,18 @@
 from game import *
 from actor import *
+import settings
+import solver
+import batch
+import validate
+import mapfile
+import bench
+import snapshot
+import json
 import pytest
 import pygame
 import os
+import subprocess
+import sys
 
 # USE PYGAME VARIABLES INSTEAD
 keys_pressed = [0] * 323
@@ -247,7 +257,7 @@ def test_9_undo():
     """
     game = setup_map("student_map1.txt")
     copy = game._copy()
-    game._history.push(game._copy())
+    game._history.push(game._save())
     move(up=1, down=0, left=0, right=0, times=1, game=game)
     game._undo()
 
@@ -281,7 +291,7 @@ def test_11_undo_moved_actor():
     assert type(game.get_actor(3, 1)) == Subject
 
     copy = game._copy()
-    game._history.push(game._copy())
+    game._history.push(game._save())
     move(up=0, down=0, left=0, right=1, times=1, game=game)
 
     assert game.get_actor(4, 1).word == "Wall"
@@ -347,6 +357,942 @@ def test_12_check_is_block_properties():
     assert "Wall isVictory" in update and "Flag isLose" in update
 
 
+def test_13_grid_index_lookup(tmp_path):
+    """
+    Checks that the grid index stays consistent with the actors' positions
+    while pushing blocks around, and that get_actor agrees with a full scan.
+    """
+    game = setup_map("student_map5.txt")
+    game.check_index = True
+
+    move(up=0, down=0, left=0, right=1, times=4, game=game)
+    move(up=0, down=1, left=0, right=0, times=4, game=game)
+    move(up=0, down=0, left=0, right=1, times=2, game=game)
+    move(up=1, down=0, left=0, right=0, times=1, game=game)
+    game._update()
+
+    assert game.index_consistent()
+    for x in range(game.x_tiles):
+        for y in range(game.y_tiles):
+            found = [i for i in game.get_actors() if (i.x, i.y) == (x, y)]
+            assert game.get_actors_at(x, y) == found
+            assert game.get_actor(x, y) is (found[0] if found else None)
+
+    # the player steps onto the block of "Rock isVictory" at the end of the
+    # line it pushes, and comes before it in the list of actors
+    path = tmp_path / "stacked.txt"
+    path.write_text("MIY....\n"
+                    "2R5....\n"
+                    ".I.....\n"
+                    ".V.....\n")
+    game = solver.load_game(str(path))
+    assert game.get_rules() == ["Meepo isYou", "Rock isVictory"]
+    assert game.step(1, 0)
+    player, block = game.get_actors_at(1, 1)
+    assert player is game.player and game.get_actor(1, 1) is player
+    assert game.get_rules() == ["Meepo isYou"]
+    copy = game._copy()
+    copy._update()
+    assert copy.get_rules() == game.get_rules()
+    assert game.index_consistent()
+
+
+def test_14_incremental_rules():
+    """
+    Checks that updating the rules after each move only re-reads the "is"
+    blocks next to the moved actors, and agrees with reading them all.
+    """
+    game = setup_map("student_map5.txt")
+    assert game._update() is None and not game._dirty
+
+    steps = [(0, 0, 0, 1, 4), (0, 1, 0, 0, 4), (0, 0, 0, 1, 2),
+             (1, 0, 0, 0, 1), (0, 0, 0, 1, 1), (0, 1, 0, 0, 4)]
+    for up, down, left, right, times in steps:
+        for _ in range(times):
+            move(up, down, left, right, 1, game)
+            near = game._is_near_dirty()
+            for is_block in game.get_is_blocks():
+                if is_block not in near:
+                    assert abs(is_block.x - game.player.x) + \
+                           abs(is_block.y - game.player.y) > 1
+            game._update()
+            full = game._copy()
+            full._update()
+            assert sorted(game.get_rules()) == sorted(full.get_rules())
+
+
+def test_15_registry_by_type():
+    """
+    Checks that the registry of actors by type follows the actors that are
+    removed when losing, and that rules reach every actor of their subject.
+    """
+    game = setup_map("student_map5.txt")
+    game.check_index = True
+    meepo = game.player
+    assert game.get_instances(Meepo) == [meepo]
+    assert Game.get_character("Rock") is Rock
+    assert Game.get_character("Is") is None
+
+    move(up=0, down=0, left=0, right=1, times=4, game=game)
+    move(up=0, down=1, left=0, right=0, times=3, game=game)
+    move(up=0, down=0, left=0, right=1, times=1, game=game)
+    game._update()
+
+    walls = [i for i in game.get_actors() if isinstance(i, Wall)]
+    assert game.get_instances(Wall) == walls
+    assert all(wall.is_lose() for wall in game.get_instances(Wall))
+
+    move(up=0, down=0, left=1, right=0, times=1, game=game)
+    move(up=0, down=1, left=0, right=0, times=3, game=game)
+    game.win_or_lose()
+    assert game.get_instances(Meepo) == []
+    assert game.index_consistent()
+
+
+def test_16_undo_deltas():
+    """
+    Checks that undoing moves one at a time, through the deltas recorded on
+    the history stack, brings every actor, flag and rule back, including after
+    the player is lost.
+    """
+    game = setup_map("student_map5.txt")
+    game.check_index = True
+
+    def state():
+        return ([(type(i), i.x, i.y, i.save_state())
+                 for i in game.get_actors()],
+                sorted(game.get_rules()), game.player)
+
+    states = []
+    for keys, times in [((0, 0, 0, 1), 4), ((0, 1, 0, 0), 3),
+                        ((0, 0, 0, 1), 1), ((0, 0, 1, 0), 1)]:
+        for _ in range(times):
+            states.append(state())
+            set_keys(*keys)
+            save = game._save()
+            if game.player.player_move(game) and not game.win_or_lose():
+                game._history.push(save)
+            game._update()
+
+    # walks into a wall, which is now lose
+    set_keys(0, 1, 0, 0)
+    save = game._save()
+    game.player.player_move(game)
+    game.player.player_move(game)
+    game.player.player_move(game)
+    assert game.win_or_lose()
+    game._update()
+    assert game.player is None
+
+    while states:
+        game._undo()
+        game._update()
+        assert state() == states.pop()
+    assert len(save.actors) < 10
+
+
+def test_17_sprite_cache(monkeypatch):
+    """
+    Checks that sprites are loaded once and shared by every actor using them,
+    with Meepo's mirrored images built up front, and loaded again at the new
+    size once the cache is cleared after TILESIZE changes.
+    """
+    clear_sprite_cache()
+    game = setup_map("student_map5.txt")
+    # images are loaded the first time they are drawn
+    assert all(i.image is not None for i in game.get_actors())
+    stats = sprite_cache_stats()
+    assert stats["misses"] == stats["sprites"]
+    assert stats["hits"] > 0 and stats["bytes"] > 0
+
+    walls = game.get_instances(Wall)
+    assert all(wall.image is walls[0].image for wall in walls)
+    meepo = game.player
+    misses = sprite_cache_stats()["misses"]
+    assert meepo.walk_left[0] is load_image(PLAYER_SPRITE_R1, flip=True)
+    assert sprite_cache_stats()["misses"] == misses
+    assert meepo.walk_left[0] is not meepo.walk_right[0]
+
+    # loading the map again only reuses the sprites already loaded
+    misses = sprite_cache_stats()["misses"]
+    game = setup_map("student_map5.txt")
+    assert all(i.image is not None for i in game.get_actors())
+    assert sprite_cache_stats()["misses"] == misses
+
+    monkeypatch.setattr(settings, "TILESIZE", 20)
+    clear_sprite_cache()
+    assert meepo.image.get_size() == (20, 20)
+    assert load_image(PLAYER_SPRITE_R1, 35, 35).get_size() == (35, 35)
+
+
+def test_18_headless_without_pygame():
+    """
+    Checks that a headless game can be loaded, played, undone and copied in a
+    process where pygame cannot be imported.
+    """
+    code = "\n".join([
+        "import sys",
+        "sys.modules['pygame'] = None",
+        "from game import Game",
+        "game = Game(headless=True)",
+        "game.load_map('maps/student_map2.txt')",
+        "game.new()",
+        "game._update()",
+        "assert game.step(1, 0)",
+        "assert 'Wall isPush' in game.get_rules()",
+        "assert game.get_actor(4, 1).word == 'Wall'",
+        "game._undo()",
+        "game._update()",
+        "assert game.player.x == 2",
+        "assert 'Wall isPush' not in game.get_rules()",
+        "copy = game._copy()",
+        "assert copy.headless",
+        "copy._undo()",
+    ])
+    result = subprocess.run([sys.executable, "-c", code],
+                            cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    # a headless game and its copies print nothing
+    assert result.stdout == ""
+
+
+def test_19_board_round_trip():
+    """
+    Checks that the compact board of a game can be copied, compared and
+    loaded back into the game, including after the player was lost.
+    """
+    game = setup_map("student_map5.txt")
+    start = game.get_board()
+    assert len(start.tiles) == len(game.get_actors())
+    assert start.tiles.count("I") == len(game.get_is_blocks())
+    assert start.copy() == start and hash(start.copy()) == hash(start)
+
+    for dx, dy, times in [(1, 0, 4), (0, 1, 3), (1, 0, 1), (-1, 0, 1)]:
+        for _ in range(times):
+            game.step(dx, dy)
+    middle = game.get_board(like=start)
+    assert middle != start and "Wall isLose" in middle.get_rules()
+
+    for _ in range(3):
+        game.step(0, 1)
+    assert game.player is None
+    end = game.get_board(like=start)
+    assert end.get_player() is None
+
+    game.load_board(start)
+    game._update()
+    assert game.get_board(like=start) == start
+    assert game.index_consistent()
+    assert (game.player.x, game.player.y) == (5, 2)
+
+    game.load_board(end)
+    game._update()
+    assert game.get_board(like=start) == end
+    game.load_board(middle)
+    game._update()
+    assert game.get_board(like=start) == middle
+    assert game.index_consistent()
+
+
+SOLVABLE_MAP = """\
+11111111
+1MIY...1
+1FIV...1
+12..4.51
+11111111
+"""
+
+
+def test_20_solver_finds_shortest_win(tmp_path):
+    """
+    Checks that the solver finds the fewest moves winning a small map, and
+    that playing them wins the game.
+    """
+    path = tmp_path / "solvable.txt"
+    path.write_text(SOLVABLE_MAP)
+
+    result = solver.solve(solver.load_game(str(path)), max_nodes=10000)
+    assert result.status == solver.SOLVED
+    assert result.moves == "RRRRR"
+    assert result.expanded > 0 and result.generated > 0
+
+    game = solver.load_game(str(path))
+    for direction in result.moves:
+        game.step(*DIRECTIONS[direction])
+    assert not game.get_running()
+
+    result = solver.solve(solver.load_game(str(path)), astar=True)
+    assert result.status == solver.SOLVED
+
+    # a move losing one of the players leaves the others playing, and is
+    # not recorded for undo
+    path.write_text("1MIY.RIL.FIV\n"
+                    "...2.4222225\n"
+                    "5...2....24.\n")
+    result = solver.solve(solver.load_game(str(path)))
+    assert result.moves == "R"
+
+
+def test_21_solver_limits():
+    """
+    Checks that the solver reports maps it cannot win, and stops at its node
+    limit.
+    """
+    result = solver.solve(solver.load_game("maps/student_map1.txt"))
+    assert result.status == solver.UNSOLVABLE and result.moves is None
+
+    result = solver.solve(solver.load_game("maps/student_map5.txt"),
+                          max_nodes=50)
+    assert result.status == solver.NODE_LIMIT
+    assert result.expanded == 50
+
+
+def test_22_state_hash():
+    """
+    Checks that the state hash is kept up to date by moves, rule changes and
+    undo, and only depends on the state reached.
+    """
+    game = setup_map("student_map2.txt")
+    game.check_index = True
+    start = game.state_hash()
+
+    assert not game.step(0, 1)
+    assert game.state_hash() == start
+    assert game.step(-1, 0)
+    assert game.state_hash() != start
+    assert game.step(1, 0)
+    assert game.state_hash() == start
+
+    game.step(1, 0)
+    assert "Wall isPush" in game.get_rules()
+    assert game.state_hash() != start
+    game._undo()
+    game._update()
+    assert game.state_hash() == start
+    assert game._copy().state_hash() != start
+
+    # the order of the rules decides the flags, so it changes the hash
+    game._set_rules(["Meepo isYou", "Meepo isPush"])
+    first = game.state_hash()
+    game._set_rules(["Meepo isPush", "Meepo isYou"])
+    assert game.state_hash() != first
+    assert game.state_hash() == game._compute_hash()
+
+
+def test_23_dirty_rendering():
+    """
+    Checks that redrawing only the changed tiles gives the same screen as
+    redrawing everything.
+    """
+    game = setup_map("student_map2.txt")
+    game.set_dirty_rendering(True)
+    game._draw()
+    assert game._redraw == set()
+
+    for dx, dy in [(-1, 0), (1, 0), (1, 0)]:
+        game.step(dx, dy)
+        assert game._redraw
+        game._draw()
+        assert game._redraw == set()
+        dirty = pygame.image.tostring(game.screen, "RGB")
+
+        game.set_dirty_rendering(False)
+        game._draw()
+        assert pygame.image.tostring(game.screen, "RGB") == dirty
+        game.set_dirty_rendering(True)
+        game._draw()
+
+    game._draw()
+    assert game._redraw == set()
+
+
+def test_24_event_driven_loop():
+    """
+    Checks that the event driven loop handles the key presses waiting in the
+    queue and measures their latency, which is below a frame.
+    """
+    game = setup_map("student_map2.txt")
+    game.set_dirty_rendering(True)
+    pygame.event.clear()
+    pygame.event.post(pygame.event.Event(pygame.KEYDOWN, key=Z))
+    pygame.event.post(pygame.event.Event(pygame.QUIT))
+    game.run(event_driven=True)
+    assert not game.get_running()
+
+    latency = game.get_input_latency()
+    assert latency["count"] == 1
+    assert 0 <= latency["max"] < 1000 // FPS
+
+
+def test_25_apply_moves(tmp_path):
+    """
+    Checks that a sequence of moves is played like key presses, can be
+    undone, with the move before when not recorded, and stops at a win.
+    """
+    game = setup_map("student_map2.txt")
+    start = game.state_hash()
+    assert game.apply_moves("LR") == 2
+    assert game.state_hash() == start
+    game._undo()
+    game._undo()
+    assert game.state_hash() == start
+
+    # moves not recorded are undone with the move before them
+    assert game.apply_moves("L") == 1
+    assert game.apply_moves([(1, 0), (-1, 0)], record=False) == 2
+    assert game.state_hash() != start
+    game._undo()
+    assert game.state_hash() == start
+    assert game._history.is_empty() and game.index_consistent()
+    with pytest.raises(ValueError):
+        game.apply_moves("X")
+
+    path = tmp_path / "solvable.txt"
+    path.write_text(SOLVABLE_MAP)
+    game = solver.load_game(str(path))
+    assert game.apply_moves("RRRRRRRR", record=False) == 5
+    assert not game.get_running()
+
+
+def test_26_batch_matches_game(tmp_path):
+    """
+    Checks that the games of a batch go through the same states as games
+    played one by one with the same moves, and that wins are reported.
+    """
+    np = pytest.importorskip("numpy")
+    rng = np.random.default_rng(0)
+    for map_name in ["student_map2.txt", "student_map5.txt"]:
+        path = os.path.abspath(os.getcwd()) + '/maps/' + map_name
+        games = [solver.load_game(path) for i in range(8)]
+        roots = [game.get_board() for game in games]
+        simulator = batch.BatchGame(games[0], len(games))
+        for i in range(60):
+            moves = "".join(rng.choice(list(DIRECTIONS), size=len(games)))
+            active = simulator.active()
+            simulator.step(moves)
+            for n, game in enumerate(games):
+                if active[n]:
+                    game.step(*DIRECTIONS[moves[n]], record=False)
+                assert game.get_board(like=roots[n]).key() \
+                    == simulator.get_board(n).key()
+
+    path = tmp_path / "solvable.txt"
+    path.write_text(SOLVABLE_MAP)
+    simulator = batch.BatchGame(solver.load_game(str(path)), 3)
+    for i in range(4):
+        won, lost = simulator.step("RRL")
+        assert not won.any() and not lost.any()
+    won, lost = simulator.step([1, 1, 1])
+    assert list(won) == [True, True, False]
+    assert list(simulator.active()) == [False, False, True]
+
+
+def test_27_validate_maps(tmp_path):
+    """
+    Checks that maps are checked in parallel and reported in order, with the
+    maps without a player or that cannot be solved marked invalid.
+    """
+    solvable = tmp_path / "solvable.txt"
+    solvable.write_text(SOLVABLE_MAP)
+    no_player = tmp_path / "no_player.txt"
+    no_player.write_text(SOLVABLE_MAP.replace("MIY", "MI."))
+    paths = [str(solvable), str(no_player), str(tmp_path / "missing.txt")]
+
+    report = tmp_path / "report.json"
+    assert validate.main(paths + ["--workers", "2", "--solve",
+                                  "--output", str(report)]) == 1
+    results = json.loads(report.read_text())
+    assert [result["map"] for result in results] == paths
+    assert results[0]["valid"] and results[0]["moves"] == "RRRRR"
+    assert results[0]["player"] == "Meepo" and results[0]["actors"] == 31
+    assert results[0]["total_time"] >= results[0]["solve_time"] > 0
+    assert not results[1]["valid"] and "no player" in results[1]["error"]
+    assert not results[2]["valid"]
+    assert "FileNotFoundError" in results[2]["error"]
+
+    results = validate.validate_maps([str(solvable)], workers=1)
+    assert results[0]["valid"] and results[0]["solve_status"] is None
+    csv_report = validate.format_report(results, "csv").splitlines()
+    assert csv_report[0] == ",".join(validate.FIELDS)
+    assert len(csv_report) == 2
+
+
+def test_28_stream_map(tmp_path):
+    """
+    Checks that streaming a map creates the same actors as loading it, without
+    keeping its text, and that rows of different widths are rejected.
+    """
+    path = os.path.abspath(os.getcwd()) + '/maps/student_map5.txt'
+    loaded = Game(headless=True)
+    loaded.load_map(path)
+    loaded.new()
+    streamed = Game(headless=True)
+    streamed.stream_map(path)
+    assert streamed.map_data == []
+    assert streamed.size == loaded.size
+    assert (streamed.x_tiles, streamed.y_tiles) \
+        == (loaded.x_tiles, loaded.y_tiles)
+    assert [(type(i), i.x, i.y) for i in streamed.get_actors()] \
+        == [(type(i), i.x, i.y) for i in loaded.get_actors()]
+    assert streamed.state_hash() == loaded.state_hash()
+
+    big = tmp_path / "big.txt"
+    big.write_text("MIY" + "." * 297 + "\n" + ("3.2." * 75 + "\n") * 299
+                   + "\n\n")
+    calls = []
+    game = Game(headless=True)
+    game.stream_map(str(big), lambda *args: calls.append(args))
+    assert game.tiles_number == (300, 300)
+    assert len(game.get_actors()) == 3 + 299 * 150
+    assert calls[-1] == (300, big.stat().st_size, big.stat().st_size)
+
+    bad = tmp_path / "bad.txt"
+    bad.write_text("1111\n1.2\n1111\n")
+    with pytest.raises(mapfile.MapFormatError):
+        Game(headless=True).stream_map(str(bad))
+    bad.write_text("1111\n\n1111\n")
+    with pytest.raises(mapfile.MapFormatError):
+        Game(headless=True).stream_map(str(bad))
+
+
+def test_29_compiled_map(tmp_path):
+    """
+    Checks that a compiled map round trips to text and loads the same actors
+    as its text, which is used instead when there is no compiled map.
+    """
+    text = tmp_path / "solvable.txt"
+    text.write_text(SOLVABLE_MAP)
+    text_game = Game(headless=True)
+    text_game.stream_map(str(text))
+
+    compiled = mapfile.compile_map(str(text))
+    assert compiled == str(tmp_path / "solvable.map")
+    with mapfile.CompiledMap(compiled) as compiled_map:
+        assert (compiled_map.width, compiled_map.height) == (8, 5)
+        assert compiled_map.to_text() == SOLVABLE_MAP
+        row = compiled_map.row(1)
+        assert bytes(row) == b"1MIY...1"
+        row.release()
+
+    for path in [str(text), compiled]:
+        game = Game(headless=True)
+        game.stream_map(path)
+        assert game.size == text_game.size
+        assert game.state_hash() == text_game.state_hash()
+
+    # load_map reads the compiled map too, while it is up to date
+    text.write_text(SOLVABLE_MAP.replace("MIY", "MIV"))
+    os.utime(text, (0, 0))
+    assert solver.load_game(str(text)).state_hash() \
+        == solver.load_game(compiled).state_hash()
+
+    # a text map newer than its compiled map is read instead
+    os.utime(text)
+    os.utime(compiled, (0, 0))
+    game = Game(headless=True)
+    game.stream_map(str(text))
+    assert game.state_hash() != text_game.state_hash()
+    game._update()
+    assert solver.load_game(str(text)).state_hash() == game.state_hash()
+
+    # a map failing to compile leaves no compiled map behind
+    broken = tmp_path / "broken.txt"
+    broken.write_text("1111\n11\n")
+    with pytest.raises(mapfile.MapFormatError):
+        mapfile.compile_map(str(broken))
+    assert sorted(os.listdir(tmp_path)) == [
+        "broken.txt", "solvable.map", "solvable.txt"]
+
+    (tmp_path / "empty.map").write_bytes(b"")
+    with pytest.raises(mapfile.MapFormatError):
+        mapfile.CompiledMap(str(tmp_path / "empty.map"))
+
+
+def test_30_viewport(tmp_path):
+    """
+    Checks that a map larger than VIEW_TILES is drawn in a window of that
+    size, scrolling to follow the player, and that only the actors in view
+    are drawn.
+    """
+    rows = ["3" * 80] + ["3" + "." * 78 + "3"] * 58 + ["3" * 80]
+    rows[1] = "3MIY" + rows[1][4:]
+    rows[30] = rows[30][:40] + "2" + rows[30][41:]
+    big = tmp_path / "big.txt"
+    big.write_text("\n".join(rows))
+
+    game = Game()
+    game.stream_map(str(big))
+    game._update()
+    assert game.screen.get_size() == (VIEW_TILES[0] * TILESIZE,
+                                      VIEW_TILES[1] * TILESIZE)
+    game._draw()
+    assert game.camera == (40 - VIEW_TILES[0] // 2, 30 - VIEW_TILES[1] // 2)
+    visible = game._visible_actors()
+    assert game.player in visible
+    assert len(visible) < len(game.get_actors()) // 2
+    assert all(game._in_view(i.x, i.y) for i in visible)
+
+    game.set_dirty_rendering(True)
+    for moves in ["RR", "L" * 38]:
+        game.apply_moves(moves)
+        game._draw()
+        dirty = pygame.image.tostring(game.screen, "RGB")
+        game.set_dirty_rendering(False)
+        game._draw()
+        assert pygame.image.tostring(game.screen, "RGB") == dirty
+        game.set_dirty_rendering(True)
+        game._draw()
+    assert game.player.x == 4
+    assert game.camera == (0, 30 - VIEW_TILES[1] // 2)
+
+
+def test_31_static_chunks_and_atlas():
+    """
+    Checks that bushes are drawn from chunks kept between frames and redrawn
+    when one of them moves, that walls, which can move, are not, and that
+    sprites come from one atlas.
+    """
+    game = setup_map("map.txt")
+    game._draw()
+    chunks = dict(game._chunks)
+    assert len(chunks) == 4
+    game._draw()
+    assert all(game._chunks[key] is chunk for key, chunk in chunks.items())
+
+    wall = game.get_instances(Wall)[0]
+    game.move_actor(wall, 17, 17)
+    assert game._chunks == chunks
+    bush = game.get_instances(Bush)[0]
+    game.move_actor(bush, 17, 17)
+    assert (0, 0) not in game._chunks and (1, 1) not in game._chunks
+    assert game._chunks[(1, 0)] is chunks[(1, 0)]
+    game._draw()
+
+    # the screen is the actors drawn one by one, bushes first, up to
+    # rounding
+    expected = pygame.Surface(game.view_size)
+    expected.blit(game.background, game._background_offset())
+    actors = sorted(game.get_actors(), key=lambda i: not isinstance(i, Bush))
+    for i in actors + [game.player]:
+        expected.blit(i.image, (i.x * TILESIZE, i.y * TILESIZE))
+    drawn = pygame.image.tostring(game.screen, "RGB")
+    assert max(abs(a - b) for a, b in zip(
+        drawn, pygame.image.tostring(expected, "RGB"))) <= 2
+
+    atlas = SpriteAtlas(capacity=1)
+    wall_area = atlas.area((WALL_SPRITE, False))
+    pixel = atlas.surface.get_at(wall_area.center)
+    assert atlas.area((ROCK_SPRITE, False)) != wall_area
+    assert atlas.area((WALL_SPRITE, False)) == wall_area
+    assert atlas.surface.get_at(wall_area.center) == pixel
+
+
+def test_32_benchmarks(tmp_path):
+    """
+    Checks that the benchmarks run and write a report that can be compared
+    to a previous one.
+    """
+    output = tmp_path / "bench.json"
+    assert bench.main(["--sizes", "small", "--repeat", "2",
+                       "--output", str(output)]) == 0
+    report = json.loads(output.read_text())
+    benchmarks = {result["benchmark"] for result in report["results"]}
+    assert {"new", "get_actor", "move_push_chain", "update_all_rules",
+            "copy", "undo", "draw", "snapshot_after_move",
+            "restore_after_move"} <= benchmarks
+    assert all(result["min"] <= result["mean"]
+               for result in report["results"])
+    assert report["results"][0]["peak_memory"] > 0
+
+    baseline = json.loads(output.read_text())
+    assert bench.compare(report, baseline) == []
+    for result in baseline["results"]:
+        result["min"] /= 10
+    assert len(bench.compare(report, baseline)) == len(report["results"])
+    output.write_text(json.dumps(baseline))
+    assert bench.main(["--sizes", "small", "--repeat", "2", "--output",
+                       str(tmp_path / "new.json"), "--compare",
+                       str(output)]) == 1
+
+
+def test_33_profiling(tmp_path):
+    """
+    Checks that each frame of a profiled game records the time of its phases
+    and its counters, and that a game is left as it was once profiling stops.
+    """
+    game = setup_map("student_map2.txt")
+    frames = game.enable_profiling(window=2)
+    assert game.profiler is frames
+    game.step(-1, 0)
+    game._handle_event(pygame.event.Event(pygame.KEYDOWN, key=pygame.K_F3))
+    assert frames.overlay
+    game._draw()
+    assert len(frames.frames) == 1
+    frame = frames.frames[0]
+    assert frame["get_actor"] > 0 and frame["history"] == 1
+    assert frame["update"] > 0 and frame["draw"] > 0 and frame["events"] > 0
+    assert frame["total"] == frame["events"] + frame["update"] + frame["draw"]
+
+    for i in range(3):
+        game._draw()
+    assert len(frames.frames) == 2
+    assert sum(count for bound, count in frames.histogram()) == 2
+    assert any("draw" in line for line in frames.overlay_lines())
+    frames.dump(str(tmp_path / "profile.json"))
+    dumped = json.loads((tmp_path / "profile.json").read_text())
+    assert len(dumped["frames"]) == 2
+    assert dumped["summary"]["draw"]["max"] > 0
+
+    game.disable_profiling()
+    assert game.profiler is None
+    assert not {"get_actor", "_update", "_draw", "_handle_event"} \
+        & set(vars(game))
+    game.step(1, 0)
+    game._draw()
+    assert len(frames.frames) == 2
+
+
+def test_34_replay(tmp_path, monkeypatch):
+    """
+    Checks that the key presses and undos of a game are recorded, frame by
+    frame, and that playing the replay again from the same map ends in the
+    same state.
+    """
+    game = setup_map("student_map2.txt")
+    keys = [0] * 323
+    monkeypatch.setattr(pygame.key, "get_pressed", lambda: keys)
+
+    def press(key: int, *held: int) -> None:
+        keys[:] = [0] * 323
+        for k in (key,) + held:
+            keys[k] = 1
+        game._handle_event(pygame.event.Event(pygame.KEYDOWN, key=key))
+
+    recording = game.start_recording("maps/student_map2.txt")
+    press(RIGHT)
+    game._update()
+    press(LEFT)
+    press(UP)
+    game._update()
+    game._update()
+    press(pygame.K_z, CTRL)
+    press(DOWN)
+    game._update()
+    recorded = game.stop_recording()
+    assert recorded is recording
+    assert recorded.frames == ["R", "LU", "ZD"]
+    assert "Wall isPush" in game.get_rules()
+    assert len(recorded) == 5 and recorded.times == sorted(recorded.times)
+
+    path = str(tmp_path / "replay.json")
+    recorded.save(path)
+    loaded = replay.load(path)
+    assert loaded.frames == recorded.frames and loaded.times == recorded.times
+    assert loaded.final_hash == game.state_hash()
+
+    # the recording started once the rules of the map were applied
+    again = Game(headless=True)
+    again.load_map(loaded.map_path)
+    again.new()
+    again._update()
+    assert again.play_replay(loaded)
+    assert again._compute_hash() == game._compute_hash()
+    with pytest.raises(ValueError):
+        again.play_replay(loaded)
+
+
+def test_35_push_chain_scan(tmp_path):
+    """
+    Checks that a line of blocks is pushed with a single lookup per tile
+    along the move, until it is blocked against the edge of the map.
+    """
+    path = tmp_path / "chain.txt"
+    path.write_text(bench.generate_map(16, 8))
+    game = bench.load(str(path))
+    rocks = sorted(game.get_instances(Rock), key=lambda rock: rock.x)
+    assert len(rocks) == 7
+    frames = game.enable_profiling()
+    assert game.player.move(game, 1, 0)
+    frames.end_frame()
+    assert frames.frames[-1]["get_actor"] == len(rocks) + 1
+    assert [rock.x for rock in rocks] == list(range(3, 10))
+
+    for i in range(5):
+        assert game.player.move(game, 1, 0)
+    assert not game.player.move(game, 1, 0)
+    assert [rock.x for rock in rocks] == list(range(8, 15))
+    assert game.player.x == 7
+    assert game.index_consistent()
+
+    # without walls around it, the map ends at its last tile
+    path.write_text("MIY.RIP.\n"
+                    ".24.....\n")
+    game = solver.load_game(str(path))
+    rock = game.get_instances(Rock)[0]
+    assert not game.player.move(game, 0, 1)
+    for i in range(5):
+        assert game.player.move(game, 1, 0)
+    assert not game.player.move(game, 1, 0)
+    assert (rock.x, game.player.x) == (7, 6)
+    # nor is a block pushed off it
+    assert not game.player.move(game, 0, -1)
+    assert game.index_consistent()
+
+
+def test_36_several_players(tmp_path):
+    """
+    Checks that every actor of an "isYou" subject moves on each key press,
+    the ones in front first, and that one of them losing leaves the others
+    playing.
+    """
+    path = tmp_path / "players.txt"
+    path.write_text("1111111111\n"
+                    "1MIY.RIL.1\n"
+                    "1.22..4..1\n"
+                    "1.2..1...1\n"
+                    "1111111111\n")
+    game = solver.load_game(str(path))
+    meepos = list(game.get_instances(Meepo))
+    assert game.player is meepos[0]
+    assert game.get_players() == meepos and all(m.is_player() for m in meepos)
+
+    game.step(1, 0)
+    assert [(m.x, m.y) for m in meepos] == [(3, 2), (4, 2), (3, 3)]
+    game.step(1, 0)
+    game.step(1, 0)
+    # the front one walks onto the rock and loses, the bottom one is stuck
+    assert meepos[1] not in game.get_actors()
+    assert game.player is meepos[0] and game.get_running()
+    assert game.get_players() == [meepos[0], meepos[2]]
+    assert [(m.x, m.y) for m in game.get_players()] == [(5, 2), (4, 3)]
+    # the losing move was not recorded, so it is undone with the one before
+    game._undo()
+    game._update()
+    assert game.get_players() == meepos
+    assert [(m.x, m.y) for m in meepos] == [(3, 2), (4, 2), (3, 3)]
+    assert game.index_consistent()
+
+    # a whole block of walls moves at once, without any of them in the way
+    rows = ["1" * 22, "1WIY" + "." * 17 + "1"] \
+        + ["1." + "3" * 19 + "1"] * 10 + ["1" * 22]
+    path.write_text("\n".join(rows) + "\n")
+    game = solver.load_game(str(path))
+    walls = game.get_instances(Wall)
+    assert len(game.get_players()) == len(walls) == 190
+    assert game.step(-1, 0)
+    assert sorted((w.x, w.y) for w in walls) \
+        == [(x, y) for x in range(1, 20) for y in range(2, 12)]
+    assert game.index_consistent()
+
+
+def test_37_rule_table():
+    """
+    Checks that the rules kept as a bitmask per subject match their names,
+    in the order they were formed, through moves and undos.
+    """
+    game = setup_map("student_map2.txt")
+    assert game.get_rules() == ["Meepo isYou"]
+    assert game.has_rule(Meepo, "You") and not game.has_rule(Wall, "Push")
+    start = game.state_hash()
+
+    game.step(1, 0)
+    assert game.get_rules() == ["Meepo isYou", "Wall isPush"]
+    assert game.has_rule(Wall, "Push") and not game.has_rule(Wall, "Stop")
+    assert game.index_consistent()
+
+    game._undo()
+    game._update()
+    assert game.get_rules() == ["Meepo isYou"]
+    assert not game.has_rule(Wall, "Push")
+    assert game.state_hash() == start and game.index_consistent()
+
+    game._set_rules(["Wall isStop", "Meepo isYou"])
+    assert game.has_rule(Wall, "Stop") and game.has_rule(Meepo, "You")
+    assert game.get_rules() == ["Wall isStop", "Meepo isYou"]
+    assert game.get_board().get_rules() == game.get_rules()
+
+
+def test_38_snapshots(tmp_path):
+    """
+    Checks that a snapshot taken after a move shares all but the records of
+    the actors it moved, and that restoring snapshots brings back the state
+    they were taken in, removed actors included.
+    """
+    path = tmp_path / "snapshots.txt"
+    path.write_text(bench.generate_map(64, 48))
+    game = bench.load(str(path))
+    game.check_index = True
+    board = game.get_board()
+    start = game.snapshot()
+    assert game.snapshot().root is start.root
+
+    game.step(1, 0)
+    moved = game.snapshot()
+    changes = list(snapshot.diff(start.root, moved.root, start.shift))
+    assert sorted(slot for slot, record in changes) == sorted(
+        board.actors.index(i) for i in [game.player]
+        + list(game.get_instances(Rock)))
+    # the player and the line of rocks fit in two leaves of the tree
+    shared = sum(new is old for new, old in zip(moved.root, start.root))
+    assert shared >= len(start.root) - 2
+    assert moved.get_record(board.actors.index(game.player)) == \
+        (game.player.x, game.player.y, game.player.get_flags())
+
+    game.restore(start)
+    assert game.state_hash() == start.hash
+    assert game.get_board(like=board) == board
+    game.restore(moved)
+    assert game.state_hash() == moved.hash and game.player.x == 2
+
+    path.write_text("1111111111\n"
+                    "1MIY.RIL.1\n"
+                    "1.22..4..1\n"
+                    "1111111111\n")
+    game = solver.load_game(str(path))
+    game.check_index = True
+    before = game.snapshot()
+    for i in range(3):
+        game.step(1, 0)
+    assert len(game.get_players()) == 1
+    game.restore(before)
+    assert len(game.get_players()) == 2
+    assert game.state_hash() == before.hash and game._history.is_empty()
+
+
+def test_39_undo_after_losing_move(tmp_path):
+    """
+    Checks that a move losing one of several players is still undone with
+    the move before it once the game has gone on.
+    """
+    path = tmp_path / "players.txt"
+    path.write_text("1111111111\n"
+                    "1MIY.RIL.1\n"
+                    "1.22..4..1\n"
+                    "1.2..1...1\n"
+                    "1111111111\n")
+    game = solver.load_game(str(path))
+    game.check_index = True
+    meepos = list(game.get_instances(Meepo))
+    game.step(1, 0)
+    start = game.state_hash()
+    game.step(1, 0)
+    game.step(1, 0)
+    assert meepos[1] not in game.get_actors()
+    after_loss = game.state_hash()
+    assert game.step(-1, 0)
+
+    game._undo()
+    game._update()
+    assert game.state_hash() == after_loss
+    game._undo()
+    game._update()
+    assert game.state_hash() == start
+    assert game.get_players() == meepos
+    assert [(m.x, m.y) for m in meepos] == [(3, 2), (4, 2), (3, 3)]
+    assert game.index_consistent()
+
+
 if __name__ == "__main__":
     import pytest
 
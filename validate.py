@@ -0,0 +1,140 @@
+"""
+A runner checking many maps of the game at once, spread over a pool of
+processes.
+
+Each map is loaded headless, its initial rules are formed and it must have a
+player, i.e. an "isYou" rule. Maps can also be solved with solver.solve. The
+results, with the time each step took, are reported as JSON or CSV, e.g.
+    python validate.py maps/*.txt --solve --time-limit 30 --format csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional
+from game import Game
+import solver
+
+# The columns of a report, in order
+FIELDS = ["map", "valid", "error", "width", "height", "actors", "rules",
+          "player", "solve_status", "moves", "expanded", "load_time",
+          "rules_time", "solve_time", "total_time"]
+
+
+def validate_map(path: str, solve: bool = False,
+                 max_nodes: Optional[int] = None,
+                 time_limit: Optional[float] = None) -> Dict[str, Any]:
+    """
+    Check the map at <path>, and solve it if <solve>, with the given limits.
+    Return the result as a dict of FIELDS; a map is valid if it can be
+    loaded, has a player and, when solved, was solved.
+    """
+    result = dict.fromkeys(FIELDS)
+    result["map"] = path
+    result["valid"] = False
+    start = time.perf_counter()
+    try:
+        game = Game(headless=True)
+        game.load_map(path)
+        game.new()
+        loaded = time.perf_counter()
+        result["load_time"] = loaded - start
+
+        game._update()
+        result["rules_time"] = time.perf_counter() - loaded
+        result["width"], result["height"] = game.x_tiles, game.y_tiles
+        result["actors"] = len(game.get_actors())
+        result["rules"] = " ".join(game.get_rules())
+        result["player"] = type(game.player).__name__ \
+            if game.player is not None else None
+
+        if game.player is None:
+            result["error"] = "no player: there is no isYou rule"
+        elif solve:
+            solved = solver.solve(game, max_nodes, time_limit)
+            result["solve_status"] = solved.status
+            result["moves"] = solved.moves
+            result["expanded"] = solved.expanded
+            result["solve_time"] = solved.elapsed
+            if solved.status != solver.SOLVED:
+                result["error"] = "not solved: " + solved.status
+        result["valid"] = result["error"] is None
+
+    except Exception as e:
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+    result["total_time"] = time.perf_counter() - start
+    return result
+
+
+def validate_maps(paths: List[str], workers: Optional[int] = None,
+                  solve: bool = False, max_nodes: Optional[int] = None,
+                  time_limit: Optional[float] = None) \
+        -> List[Dict[str, Any]]:
+    """
+    Check the maps at <paths> with validate_map, using up to <workers>
+    processes (by default, one per CPU), and return their results in the
+    order of <paths>.
+    """
+    workers = min(workers or os.cpu_count() or 1, max(len(paths), 1))
+    arguments = ([solve] * len(paths), [max_nodes] * len(paths),
+                 [time_limit] * len(paths))
+    if workers == 1:
+        return list(map(validate_map, paths, *arguments))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(validate_map, paths, *arguments))
+
+
+def format_report(results: List[Dict[str, Any]], fmt: str) -> str:
+    """
+    Return <results> as a report in the format <fmt>, "json" or "csv".
+    """
+    if fmt == "json":
+        return json.dumps(results, indent=2)
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=FIELDS, lineterminator="\n")
+    writer.writeheader()
+    writer.writerows(results)
+    return output.getvalue()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """
+    Check the maps given on the command line and write the report.
+    Return 0 if every map is valid, 1 otherwise.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check maps of the game in parallel.")
+    parser.add_argument("maps", nargs="+", help="map files to check")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="the largest number of processes to use")
+    parser.add_argument("--solve", action="store_true",
+                        help="also check that each map can be won")
+    parser.add_argument("--max-nodes", type=int, default=None,
+                        help="stop solving after expanding this many states")
+    parser.add_argument("--time-limit", type=float, default=None,
+                        help="stop solving after this many seconds per map")
+    parser.add_argument("--format", choices=["json", "csv"], default="json",
+                        help="the format of the report")
+    parser.add_argument("--output", default=None,
+                        help="write the report to this file instead of "
+                             "printing it")
+    args = parser.parse_args(argv)
+
+    results = validate_maps(args.maps, args.workers, args.solve,
+                            args.max_nodes, args.time_limit)
+    report = format_report(results, args.format)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report)
+    return 0 if all(result["valid"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())